@@ -0,0 +1,190 @@
+# 何年分もの記録ファイルを複数のプロセスで集計し直す
+#
+# ファイルを行の切れ目で区切った塊(Chunk)ごとに各プロセスが対戦カード別の途中集計を作り、
+# それを塊の順番どおりに足し合わせる
+# オッズは後から足したもので上書きするので、1プロセスで先頭から読んだ場合と結果は完全に一致する
+#
+# 使い方
+# python aggregate_module.py -o record_all.csv a.csv b_journal.csv c.bin ...
+import argparse
+import codecs
+import csv
+import os
+import data_module
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple
+
+
+# 1つの塊の大きさ(バイト数、.binの場合は行数に換算する)
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class Chunk(NamedTuple):
+  """
+  ファイルの一部分
+  csvの場合は [start, end) バイト目から始まる行、.binの場合は [start, end) 行目
+  """
+  file_name: str
+  start: int
+  end: int
+
+
+def split_file(file_name: str, chunk_size: int = CHUNK_SIZE) -> list[Chunk]:
+  if data_module.RecordSnapshot.is_snapshot_file_name(file_name):
+    # ここではヘッダだけを読み、列は塊ごとに必要な範囲だけを読む(iter_chunk()を参照)
+    snapshot = data_module.RecordSnapshot(file_name)
+    row_count = len(snapshot)
+    snapshot.close()
+    step = max(1, chunk_size // data_module.RecordSnapshot.ROW_SIZE)
+    return [Chunk(file_name, start, min(start + step, row_count))
+            for start in range(0, row_count, step)]
+
+  size = os.path.getsize(file_name)
+  return [Chunk(file_name, start, min(start + chunk_size, size))
+          for start in range(0, size, chunk_size)]
+
+
+def iter_chunk(chunk: Chunk):
+  """
+  塊に含まれる FightLog を順に返すジェネレータ
+  """
+  if data_module.RecordSnapshot.is_snapshot_file_name(chunk.file_name):
+    snapshot = data_module.RecordSnapshot(chunk.file_name)
+    try:
+      name_list = snapshot.name_list
+      def to_name(char_id_in_file: int) -> str:
+        if char_id_in_file == data_module.NameList.EMPTY_ID:
+          return ""
+        return name_list[char_id_in_file]
+      for row in snapshot.iter_rows(chunk.start, chunk.end):
+        yield data_module.FightLog(tuple(to_name(char_id) for char_id in row[0:4]),
+                                   row[4],
+                                   row[5:10],
+                                   row[10:14])
+    finally:
+      snapshot.close()
+    return
+
+  with open(chunk.file_name, 'rb') as f:
+    for row in csv.reader(_iter_chunk_line(f, chunk)):
+      fight_log = data_module.parse_fight_log_row(row)
+      if fight_log != None:
+        yield fight_log
+
+
+def _iter_chunk_line(f, chunk: Chunk):
+  # startより前から続いている行は前の塊が読む
+  if chunk.start > 0:
+    f.seek(chunk.start - 1)
+    f.readline()
+  elif f.read(len(codecs.BOM_UTF8)) != codecs.BOM_UTF8:
+    # ファイルの先頭のBOMだけを読み飛ばす(data_module.iter_fight_log()と同じ)
+    f.seek(0)
+  while f.tell() < chunk.end:
+    line = f.readline()
+    if len(line) == 0:
+      break
+    yield line.decode("utf-8")
+
+
+def aggregate_chunk(chunk: Chunk) -> dict:
+  """
+  塊の中身を対戦カードごとに集計する(各プロセスで実行する)
+  """
+  table = {}
+  for fight_log in iter_chunk(chunk):
+    _add(table, fight_log.names, fight_log.total, fight_log.result_list, fight_log.odds_list)
+  return table
+
+
+def _add(table: dict, names: tuple, total: int, result_list, odds_list):
+  """
+  tableは {キャラ名を並べ替えたタプル: [キャラ名, 試合数, 勝利数x4と引き分け数, オッズx4]}
+  キャラ名などの並びは、その対戦カードが最初に出てきたときの並び
+  (Record.merge() で新しい行を作るときと同じ)
+  """
+  key = tuple(sorted(names))
+  entry = table.get(key)
+  if entry == None:
+    entry = [names, 0, [0] * 5, [0.0] * 4]
+    table[key] = entry
+
+  # namesの並びをentryの並びに合わせる(同じキャラが複数いる場合はそれぞれ別の位置にする)
+  unused_list = [True] * 4
+  slot_list = []
+  for name in names:
+    for i in range(4):
+      if unused_list[i] and entry[0][i] == name:
+        unused_list[i] = False
+        slot_list.append(i)
+        break
+  slot_list.append(4)
+
+  entry[1] += total
+  for i in range(5):
+    entry[2][slot_list[i]] += result_list[i]
+  for i in range(4):
+    entry[3][slot_list[i]] = odds_list[i]
+
+
+def aggregate_files(file_name_list: list[str], worker_count: int = None,
+                    chunk_size: int = CHUNK_SIZE) -> list[data_module.FightLog]:
+  """
+  ファイルを全部読んで、対戦カードごとに1つの FightLog にまとめる
+  並びは各対戦カードが最初に出てきた順
+  worker_countを1にすると、このプロセスだけで集計する
+  スナップショットに反映済みのジャーナルが一緒に渡された場合は ValueError を投げる
+  (data_module.check_journal_generation()を参照)
+  """
+  data_module.check_journal_generation(file_name_list)
+  chunk_list = [chunk
+                for file_name in file_name_list
+                for chunk in split_file(file_name, chunk_size)]
+  if worker_count == 1:
+    return _reduce(map(aggregate_chunk, chunk_list))
+  with ProcessPoolExecutor(worker_count) as executor:
+    # mapは渡した順に結果を返す
+    return _reduce(executor.map(aggregate_chunk, chunk_list))
+
+
+def _reduce(table_iter) -> list[data_module.FightLog]:
+  # 塊の順番どおりに足すので、オッズは最後に出てきたものが残る
+  total_table = {}
+  for table in table_iter:
+    for names, total, result_list, odds_list in table.values():
+      _add(total_table, names, total, result_list, odds_list)
+  return [data_module.FightLog(names, total, tuple(result_list), tuple(odds_list))
+          for names, total, result_list, odds_list in total_table.values()]
+
+
+def main():
+  parser = argparse.ArgumentParser(description = "記録ファイルをまとめて集計し直す")
+  parser.add_argument("file_name", nargs = "+",
+                      help = "record.csv, record.bin, ジャーナルのいずれかの形式のファイル")
+  parser.add_argument("-o", "--output", required = True,
+                      help = "書き出す先(すでにある場合は足し合わせる)")
+  parser.add_argument("-c", "--char", default = "char_name.csv", help = "キャラ一覧")
+  parser.add_argument("-j", "--jobs", type = int, default = None,
+                      help = "プロセス数(省略するとCPUの数)")
+  args = parser.parse_args()
+
+  try:
+    fight_log_list = aggregate_files(args.file_name, args.jobs)
+  except ValueError as error:
+    parser.error(str(error))
+
+  if not os.path.exists(args.output):
+    if data_module.RecordSnapshot.is_snapshot_file_name(args.output):
+      data_module.RecordSnapshot.write(args.output, [],
+                                       [()] * len(data_module.RecordSnapshot.COLUMN_TYPECODE_LIST))
+    else:
+      open(args.output, 'w').close()
+
+  record = data_module.Record(args.output, data_module.NameList(args.char))
+  record.merge(fight_log_list)
+  record.close()
+  print("{}件の対戦カードを {} に書き出しました".format(len(fight_log_list), args.output))
+
+
+if __name__ == "__main__":
+  main()
@@ -1,26 +1,1759 @@
+import array
+import atexit
+import bisect
+import contextlib
 import csv
+import hashlib
+import heapq
+import mmap
+import os
+import queue
+import shutil
+import struct
+import sys
+import threading
+import time
 import tkinter
+import traceback
+import stats_module
+from typing import NamedTuple
+
+
+@contextlib.contextmanager
+def atomic_open(file_name: str, mode: str = 'w', **kwargs):
+  """
+  ファイルを置き換えるように書き込む
+  一時ファイルに書いてfsyncしてから os.replace するので、
+  途中で落ちても元のファイルか新しいファイルのどちらかが必ず残る
+  """
+  temp_file_name = file_name + ".tmp"
+  try:
+    with open(temp_file_name, mode, **kwargs) as f:
+      yield f
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_file_name, file_name)
+  except BaseException:
+    if os.path.exists(temp_file_name):
+      os.remove(temp_file_name)
+    raise
+  _fsync_directory(os.path.dirname(os.path.abspath(file_name)))
+
+
+def _fsync_directory(directory_name: str):
+  # ファイル名の置き換えを確定させる(Windowsではディレクトリを開けないので何もしない)
+  if os.name != "posix":
+    return
+  fd = os.open(directory_name, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+
+def rotate_backup(file_name: str, backup_count: int):
+  """
+  file_nameを file_name.bak1 にコピーし、古いバックアップを1つずつずらす
+  file_name.bak{backup_count} より古いものは消える
+  """
+  if backup_count <= 0 or not os.path.exists(file_name):
+    return
+  for i in range(backup_count - 1, 0, -1):
+    backup_file_name = "{}.bak{}".format(file_name, i)
+    if os.path.exists(backup_file_name):
+      os.replace(backup_file_name, "{}.bak{}".format(file_name, i + 1))
+  shutil.copy2(file_name, file_name + ".bak1")
+
+
+def timestamp_backup(file_name_list: list[str]):
+  """
+  各ファイルを file_name.20240101-120000.bak のように日時を付けた名前でコピーする
+  rotate_backup() と違って古いものは消さない
+  全部のファイルに同じ日時を付けるので、組み合わせて戻せる
+  """
+  stamp = time.strftime("%Y%m%d-%H%M%S")
+  suffix = ".{}.bak".format(stamp)
+  count = 1
+  # 同じ秒に2回行っても上書きしない
+  while any(os.path.exists(file_name + suffix) for file_name in file_name_list):
+    suffix = ".{}-{}.bak".format(stamp, count)
+    count += 1
+  for file_name in file_name_list:
+    if os.path.exists(file_name):
+      shutil.copy2(file_name, file_name + suffix)
+
+
+# スナップショットとジャーナルの先頭に書く、ジャーナルの世代を表す行の目印
+# [JOURNAL_GENERATION_TAG, 世代] の2列で、csvの記録としては読み飛ばされる
+JOURNAL_GENERATION_TAG = "#journal"
+
+
+def parse_journal_generation(row: list[str]) -> int:
+  """
+  ジャーナルの世代を表す行なら世代を、それ以外の行ならNoneを返す
+  """
+  if row == None or len(row) != 2 or row[0] != JOURNAL_GENERATION_TAG:
+    return None
+  try:
+    return int(row[1])
+  except ValueError:
+    return None
+
+
+def read_journal_generation(file_name: str) -> int:
+  """
+  ジャーナルの世代
+  ファイルがないか空の場合はNone、世代の行がない古い形式の場合は1
+  """
+  if not os.path.exists(file_name):
+    return None
+  with open(file_name, encoding="utf-8", errors="replace") as f:
+    first_row = next(csv.reader(f), None)
+  if first_row == None:
+    return None
+  generation = parse_journal_generation(first_row)
+  return 1 if generation == None else generation
+
+
+def read_snapshot_generation(file_name: str) -> int:
+  """
+  スナップショット(record.csvかrecord.bin)に含まれているジャーナルの世代
+  世代の行がない古い形式の場合は0
+  """
+  if RecordSnapshot.is_snapshot_file_name(file_name):
+    snapshot = RecordSnapshot(file_name)
+    snapshot.close()
+    return snapshot.journal_generation
+  with open(file_name, encoding="utf-8-sig", errors="replace") as f:
+    generation = parse_journal_generation(next(csv.reader(f), None))
+  return 0 if generation == None else generation
+
+
+def check_journal_generation(file_name_list: list[str]):
+  """
+  足し合わせるファイルに、スナップショットと、それにすでに含まれている世代の
+  ジャーナル(compactのあとに残ったものやバックアップ)が一緒に入っていれば ValueError を投げる
+  そのまま足し合わせると同じ試合を2回数えてしまう
+  ジャーナルはスナップショットと同じ場所の <名前>_journal.csv を組とみなす
+  """
+  path_dict = {os.path.normcase(os.path.abspath(file_name)): file_name
+               for file_name in file_name_list}
+  for file_name in file_name_list:
+    journal_path = os.path.normcase(os.path.abspath(
+      os.path.splitext(file_name)[0] + "_journal.csv"))
+    journal_file_name = path_dict.get(journal_path)
+    if journal_file_name == None:
+      continue
+    journal_generation = read_journal_generation(journal_file_name)
+    if journal_generation != None and journal_generation <= read_snapshot_generation(file_name):
+      raise ValueError("{} is already included in {}".format(journal_file_name, file_name))
+
+
+def has_journal_row(file_name: str) -> bool:
+  """
+  ジャーナルに世代の行のほかに1戦分の行があるか
+  """
+  if not os.path.exists(file_name):
+    return False
+  with open(file_name, encoding="utf-8", errors="replace") as f:
+    return any(len(row) != 0 and parse_journal_generation(row) == None
+               for row in csv.reader(f))
+
+
+def write_snapshot_file(file_name: str, name_list: list[str], column_list: list,
+                        journal_generation: int = 0):
+  """
+  戦績データをスナップショットとして書き出す
+  column_listは [キャラidの列x4, 試合数の列, 勝利数の列x4, 引き分け数の列, オッズの列x4]
+  拡張子が .bin ならバイナリ形式(RecordSnapshot)、それ以外はrecord.csvと同じ形式
+  journal_generationはこのファイルに含まれているジャーナルの世代
+  """
+  if RecordSnapshot.is_snapshot_file_name(file_name):
+    RecordSnapshot.write(file_name, name_list, column_list, journal_generation)
+    return
+
+  def to_name(char_id: int) -> str:
+    if char_id == NameList.EMPTY_ID:
+      return ""
+    return name_list[char_id]
+
+  with atomic_open(file_name, 'w', encoding="utf-8", newline="") as f:
+    writer = csv.writer(f)
+    writer.writerow([JOURNAL_GENERATION_TAG, journal_generation])
+    writer.writerows([*(to_name(id_column[i]) for id_column in column_list[0:4]),
+                      *(column[i] for column in column_list[4:14])]
+                     for i in range(len(column_list[4])))
+
 
 class Record:
-  def __init__(self, file_name: str):
-    with open(file_name, encoding="utf-8") as f:
-      reader = csv.reader(f)
-      self.data = [row for row in reader]
-      self.file_name = file_name
+  """
+  戦績データ
+  1行が1つの対戦カードに対応する
+  record.csvの1行は [キャラ名x4, 試合数, 勝利数x4, 引き分け数, オッズx4]
+
+  メモリ上では列ごとにarrayで持つ
+  1行分をまとめて読むときは row() を使うこと
+  索引とキャラごとの集計は、最初に使われたときに作る
+
+  ファイル名の拡張子が .bin の場合はバイナリ形式(RecordSnapshot)で読み書きする
+
+  1戦ごとの結果はジャーナルファイルに追記するだけにし、
+  本体のファイル(スナップショット)の書き直しは compact() でまとめて行う
+  読み込み時はスナップショットを読んだあとジャーナルを再生する
+
+  ジャーナルには世代の番号を付け、スナップショットにはどの世代までを含むかを書く
+  compact() はスナップショットを書き換えてから次の世代の空のジャーナルを作るので、
+  その間で終了しても、スナップショットに含まれている世代のジャーナルは再生しない
+
+  ファイルへの書き込みはすべて RecordWriter のスレッドが順番に行う
+  メモリ上のデータはすぐに変わるが、ファイルに書き終わるのを待つのは flush() だけ
+  終了時には close() を呼ぶこと
+  全削除の前には、スナップショットとジャーナルを日時を付けた名前でバックアップする
+  compactの前のバックアップは BACKUP_COUNT 世代までで、古いものから消える
+  """
+  # fsyncをまとめる時間(秒)
+  SYNC_INTERVAL = 1.0
+  # 残しておくバックアップの世代数
+  BACKUP_COUNT = 3
+
+  def __init__(self, file_name: str, name_list: "NameList", journal_file_name: str = None,
+               sync_interval: float = SYNC_INTERVAL, backup_count: int = BACKUP_COUNT,
+               odds_history_file_name: str = None):
+    self.file_name = file_name
+    self.name_list = name_list
+    self.backup_count = backup_count
+    # データが変わるたびに増える(計算結果を使い回してよいかの判定用)
+    self.version = 0
+    # データの変化を通知する相手(add_listener()を参照)
+    self.listener_list = []
+    # 推定したキャラの強さ(stats_module.strength_model()で作る)
+    self.strength_model = None
+
+    if journal_file_name == None:
+      journal_file_name = os.path.splitext(file_name)[0] + "_journal.csv"
+    self.journal_file_name = journal_file_name
+    self.writer = RecordWriter(journal_file_name, sync_interval)
+
+    # 全削除やcompactをしても履歴は消さない
+    if odds_history_file_name == None:
+      odds_history_file_name = os.path.splitext(file_name)[0] + "_odds.dat"
+    self.odds_history = OddsHistory(odds_history_file_name)
+
+    self.reload()
+
+
+  def reload(self):
+    """
+    スナップショットとジャーナルを読み直す
+    """
+    self.writer.flush()
+    self._init_columns()
+    # スナップショットに含まれているジャーナルの世代(古い形式のファイルは0)
+    snapshot_generation = 0
+    if RecordSnapshot.is_snapshot_file_name(self.file_name):
+      snapshot_generation = self._load_snapshot(self.file_name)
+    else:
+      with open(self.file_name, encoding="utf-8") as f:
+        reader = csv.reader(f)
+        for row in reader:
+          generation = parse_journal_generation(row)
+          if generation != None:
+            snapshot_generation = generation
+          elif len(row) != 0:
+            self._append_csv_row(row)
+
+    journal_generation = self._replay_journal(snapshot_generation)
+    self.writer.put(GenerationEntry(snapshot_generation, journal_generation))
+
+    for listener in self.listener_list:
+      listener.on_reload()
+
+
+  def add_listener(self, listener):
+    """
+    データの変化を通知する相手を登録する
+    listenerには次の2つのメソッドを定義すること
+    on_fight(id_list, result) : commit_fight() で1戦追加されたとき
+    on_reload()               : 読み直しや削除で全データが変わったとき
+    """
+    self.listener_list.append(listener)
+
+
+  def __len__(self):
+    return len(self.total_column)
+
+
+  def row(self, row_index: int) -> "RecordRow":
+    return RecordRow(self, row_index)
+
+
+  def make_key(self, id_list: list[int]) -> tuple[int]:
+    """
+    対戦カードの並び順によらない検索用のキー
+    """
+    return tuple(sorted(id_list))
+
+
+  def find(self, id_list: list[int]) -> int:
+    """
+    対戦カードの行番号を返す
+    記録がない場合はNone
+    """
+    return self._find_key(self.make_key(id_list))
+
+
+  @property
+  def index_dict(self) -> dict[tuple[int], int]:
+    """
+    対戦カード(char_name.csvの順に並べたキャラid)から行番号を引くための索引
+    スナップショットの索引に含まれている行は入れない
+    """
+    if self._index_dict == None:
+      self._index_dict = {}
+      start = 0 if self._snapshot_index == None else len(self._snapshot_index)
+      for row_index in range(start, len(self)):
+        self._index_dict.setdefault(self.make_key(self.row_id_list(row_index)), row_index)
+    return self._index_dict
+
+
+  @property
+  def posting_dict(self) -> dict[int, set[int]]:
+    """
+    キャラidからそのキャラが含まれる行番号の集合を引くための索引
+    """
+    if self._posting_dict == None:
+      self._posting_dict = {}
+      for row_index in range(len(self)):
+        for char_id in self.row_id_list(row_index):
+          if char_id != NameList.EMPTY_ID:
+            self._posting_dict.setdefault(char_id, set()).add(row_index)
+    return self._posting_dict
+
+
+  @property
+  def character_stats_dict(self) -> dict[int, "stats_module.CharacterStats"]:
+    """
+    キャラごとの集計 {キャラid: stats_module.CharacterStats}
+    作ったあとは1戦追加するごとに更新する
+    """
+    if self._character_stats_dict == None:
+      self._character_stats_dict = stats_module.all_character_stats(self)
+    return self._character_stats_dict
+
+
+  def row_id_list(self, row_index: int) -> list[int]:
+    """
+    行に含まれるキャラのidを記録の並び順で返す
+    """
+    return [self.id_column_list[i][row_index] for i in range(4)]
+
+
+  def suggestions(self, id_list: list[int]) -> set[int]:
+    """
+    id_list全員を含む対戦カードに登場する、id_list以外のキャラidの集合
+    """
+    posting_list = sorted((self.row_index_set(char_id) for char_id in set(id_list)), key = len)
+    if len(posting_list) == 0:
+      return set()
+    row_index_set = posting_list[0].intersection(*posting_list[1:])
+
+    suggestion_set = set()
+    for i in row_index_set:
+      suggestion_set.update(self.row_id_list(i))
+    suggestion_set.difference_update(id_list)
+    suggestion_set.discard(NameList.EMPTY_ID)
+    return suggestion_set
+
+
+  def row_index_set(self, char_id: int) -> set[int]:
+    """
+    char_idのキャラが含まれる行番号の集合
+    """
+    return self.posting_dict.get(char_id, set())
+
+
+  def slot_list(self, row_index: int, id_list: list[int]) -> list[int]:
+    """
+    id_listの各キャラが記録の何番目に当たるかを返す
+    同じキャラが複数いる場合はそれぞれ別の位置に割り当てる
+    """
+    row_id_list = self.row_id_list(row_index)
+    unused_list = [True] * 4
+    slot_list = []
+    for char_id in id_list:
+      for i in range(4):
+        if unused_list[i] and row_id_list[i] == char_id:
+          unused_list[i] = False
+          slot_list.append(i)
+          break
+    return slot_list
+
+
+  def clear(self):
+    """
+    全データを削除する
+    削除前のデータは日時を付けたバックアップに残る(自動では消えない)
+    """
+    self.backup(keep = True)
+    self._init_columns()
+    self.write()
+    for listener in self.listener_list:
+      listener.on_reload()
+
 
   def write(self):
-    with open(self.file_name, 'w', encoding="utf-8", newline="") as f:
-      writer = csv.writer(f)
-      writer.writerows(self.data)
+    """
+    全データをスナップショットに書き出し、次の世代の空のジャーナルに切り替える
+    書き込みは RecordWriter が行うので、終わるのを待たずに戻る
+    (世代が進むのは RecordWriter が書き出しに成功したときだけ)
+    """
+    self.writer.put(self._snapshot_entry(self.file_name, True))
+
+
+  def backup(self, keep: bool = False):
+    """
+    スナップショットとジャーナルを1世代ずつずらしてバックアップする
+    keepがTrueなら、世代をずらさずに日時を付けた名前で残す(timestamp_backup()を参照)
+    """
+    self.writer.put(BackupEntry((self.file_name, self.journal_file_name), self.backup_count, keep))
+
+
+  def flush(self):
+    """
+    それまでに頼んだ書き込みがすべてファイルに反映され、fsyncされるまで待つ
+    """
+    self.writer.flush()
+
+
+  def close(self):
+    """
+    書き込みを済ませて RecordWriter を止める
+    これ以降はファイルに書き込めない
+    """
+    self.writer.close()
+
+
+  def save_as(self, file_name: str):
+    """
+    全データを別のファイルに書き出す
+    拡張子が .bin ならバイナリ形式、それ以外はrecord.csvと同じ形式
+    record.csvとバイナリ形式の変換に使う
+    書き終わるまで待つ
+    """
+    self.writer.put(self._snapshot_entry(file_name, False))
+    self.writer.flush()
+
+
+  def compact(self):
+    """
+    ジャーナルをスナップショットに反映する
+    終了時に呼び出すこと
+    """
+    self.writer.flush()
+    # 世代の行しかなければ、スナップショットもバックアップもそのままにする
+    if has_journal_row(self.journal_file_name):
+      self.backup()
+      self.write()
+
+
+  def commit_fight(self, id_list: list[int], result: int, odds: list[float]):
+    """
+    1戦分の結果を反映し、ジャーナルに1行だけ追記する
+    オッズの履歴(odds_history)にも1件追記する
+    id_list : 対戦キャラのid(記録と同じ並び順)
+    result  : 勝ったキャラの位置(0~3)、引き分けの場合は4
+    odds    : id_listと同じ並び順のオッズ
+    それまでのファイルへの書き込みに失敗していた場合は、この1戦を反映してジャーナルに
+    渡したあとで、その例外を投げる(メモリ上の記録とジャーナルが食い違わないようにする)
+    """
+    # idはchar_name.csvを編集すると変わるので、ジャーナルには名前で残す
+    names = tuple(self.name_list.to_name(char_id) for char_id in id_list)
+    # RecordWriterが止まっていれば、ここで何も変えずに例外になる
+    self.writer.put(JournalEntry(names, result, tuple(odds)))
+    self._apply_fight(id_list, result, odds)
+    self.writer.put(AppendEntry(self.odds_history,
+                                self.odds_history.add(names, odds, result, time.time())))
+
+    for listener in self.listener_list:
+      listener.on_fight(id_list, result)
+    self.writer.check()
+
+
+  def _snapshot_entry(self, file_name: str, clear_journal: bool) -> "SnapshotEntry":
+    # 書き込み中にデータが変わってもよいように、この時点の全列をコピーしておく
+    return SnapshotEntry(file_name, tuple(self.name_list.name_list), self._column_list(),
+                         clear_journal)
+
+
+  def _column_list(self) -> list[array.array]:
+    """
+    全列のコピー(write_snapshot_file()に渡す並び)
+    """
+    return [column[:] for column in (*self.id_column_list,
+                                     self.total_column,
+                                     *self.result_column_list,
+                                     *self.odds_column_list)]
+
+
+  def merge(self, fight_log_iter) -> int:
+    """
+    別の記録を足し合わせる
+    fight_log_iterは FightLog を1つずつ返すもの(iter_fight_log()を参照)
+    1つずつ処理するので、使うメモリは対戦カードの数だけで決まり、入力の長さにはよらない
+    終わったらスナップショットに書き出す
+    足し合わせた数を返す
+    """
+    count = 0
+    for fight_log in fight_log_iter:
+      self._merge_row([self.name_list.to_id(name) for name in fight_log.names],
+                      fight_log.total,
+                      fight_log.result_list,
+                      fight_log.odds_list)
+      count += 1
+
+    self.write()
+    for listener in self.listener_list:
+      listener.on_reload()
+    return count
+
+
+  def import_files(self, file_name_list: list[str]) -> int:
+    """
+    record.csv, record.bin, ジャーナルのどの形式のファイルでも、まとめて足し合わせる
+    スナップショットに反映済みのジャーナルが一緒に渡された場合は、何もせずに ValueError を投げる
+    (check_journal_generation()を参照)
+    足し合わせた数を返す
+    """
+    check_journal_generation(file_name_list)
+    return self.merge(fight_log
+                      for file_name in file_name_list
+                      for fight_log in iter_fight_log(file_name))
+
+
+  def _apply_fight(self, id_list: list[int], result: int, odds: list[float]) -> int:
+    result_list = [0] * 5
+    result_list[result] = 1
+    return self._merge_row(id_list, 1, result_list, odds)
+
+
+  def _merge_row(self, id_list: list[int], total: int, result_list: list[int], odds_list: list[float]) -> int:
+    """
+    total試合分の結果を足し、その行番号を返す
+    id_list, result_list(引き分けを除く), odds_list は同じ並び順で、記録の並び順と違っていてもよい
+    """
+    row_index = self._find_key(self.make_key(id_list))
+    if row_index == None:
+      row_index = self._append_row(id_list, 0, [0] * 5, [0.0] * 4)
+
+    # id_listの並びを記録の並びに合わせる
+    slot_list = self.slot_list(row_index, id_list)
+    slot_list.append(4)
+
+    self.total_column[row_index] += total
+    self.version += 1
+    for i in range(5):
+      self.result_column_list[slot_list[i]][row_index] += result_list[i]
+    for i in range(4):
+      self.odds_column_list[slot_list[i]][row_index] = odds_list[i]
+
+    if self._character_stats_dict != None:
+      for i in range(4):
+        if id_list[i] != NameList.EMPTY_ID:
+          self._character_stats_dict[id_list[i]].add(total,
+                                                     result_list[i],
+                                                     result_list[4],
+                                                     odds_list[i])
+    return row_index
+
+
+  def _init_columns(self):
+    self.version += 1
+    # キャラidの列x4
+    self.id_column_list = [array.array('H') for i in range(4)]
+    # 試合数の列
+    self.total_column = array.array('I')
+    # 勝利数の列x4と引き分け数の列(record.csvと同じ並び)
+    self.result_column_list = [array.array('I') for i in range(5)]
+    # オッズの列x4
+    self.odds_column_list = [array.array('d') for i in range(4)]
+
+    # 索引と集計は最初に使われたときに作る(index_dict, posting_dict, character_stats_dict)
+    self._index_dict = None
+    self._posting_dict = None
+    self._character_stats_dict = None
+    # スナップショットに保存されていた索引(先頭から len() 行分の対戦カードを引ける)
+    self._snapshot_index = None
+
+
+  def _append_row(
+      self,
+      id_list: list[int],
+      total: int,
+      result_list: list[int],
+      odds_list: list[float],
+      ) -> int:
+    row_index = len(self)
+    for i in range(4):
+      self.id_column_list[i].append(id_list[i])
+      self.odds_column_list[i].append(odds_list[i])
+    self.total_column.append(total)
+    for i in range(5):
+      self.result_column_list[i].append(result_list[i])
+    self._add_index(row_index)
+
+    # record.csvには最後のオッズしか残っていないので、全試合そのオッズだったとみなして集計する
+    if self._character_stats_dict != None:
+      for i in range(4):
+        if id_list[i] != NameList.EMPTY_ID:
+          character_stats = self._character_stats_dict.get(id_list[i])
+          if character_stats == None:
+            character_stats = stats_module.CharacterStats()
+            self._character_stats_dict[id_list[i]] = character_stats
+          character_stats.add(total, result_list[i], result_list[4], odds_list[i])
+    return row_index
+
+
+  def _append_csv_row(self, row: list[str]):
+    def tofloat(num: str):
+      try:
+        ret = float(num)
+      except ValueError:
+        ret = 0.0
+      return ret
+
+    row = row + [""] * (14 - len(row))
+    self._append_row([self.name_list.to_id(name) for name in row[0:4]],
+                     int(row[4]),
+                     [int(num) for num in row[5:10]],
+                     [tofloat(num) for num in row[10:14]])
+
+
+  def _load_snapshot(self, file_name: str) -> int:
+    """
+    スナップショットに含まれているジャーナルの世代を返す
+    """
+    snapshot = RecordSnapshot(file_name)
+    # ファイル内のidを現在のキャラ一覧のidに置き換える
+    id_list_in_file = [self.name_list.to_id(name) for name in snapshot.name_list]
+
+    def to_id(char_id_in_file: int):
+      if char_id_in_file == NameList.EMPTY_ID:
+        return NameList.EMPTY_ID
+      return id_list_in_file[char_id_in_file]
+
+    if snapshot.column_list == None:
+      # 行ごとの古い形式
+      for i in range(len(snapshot)):
+        row = snapshot.row(i)
+        self._append_row([to_id(char_id) for char_id in row[0:4]],
+                         row[4],
+                         list(row[5:10]),
+                         list(row[10:14]))
+    else:
+      column_list = snapshot.column_list
+      if id_list_in_file == list(range(len(id_list_in_file))):
+        # キャラ一覧が変わっていなければ、idの列と索引はそのまま使える
+        self.id_column_list = column_list[0:4]
+        self._snapshot_index = snapshot.key_index()
+      else:
+        self.id_column_list = [array.array('H', map(to_id, id_column))
+                               for id_column in column_list[0:4]]
+      self.total_column = column_list[4]
+      self.result_column_list = column_list[5:10]
+      self.odds_column_list = column_list[10:14]
+    snapshot.close()
+    return snapshot.journal_generation
+
+
+  def _find_key(self, key: tuple[int]) -> int:
+    row_index = self.index_dict.get(key)
+    if row_index == None and self._snapshot_index != None:
+      row_index = self._snapshot_index.get(key)
+    return row_index
+
+
+  def _add_index(self, row_index: int):
+    # まだ作っていない索引は、作るときに全行から作る
+    id_list = self.row_id_list(row_index)
+    if self._index_dict != None:
+      self._index_dict.setdefault(self.make_key(id_list), row_index)
+    if self._posting_dict != None:
+      for char_id in id_list:
+        if char_id != NameList.EMPTY_ID:
+          self._posting_dict.setdefault(char_id, set()).add(row_index)
+
+
+  def _replay_journal(self, snapshot_generation: int) -> int:
+    """
+    次に追記するジャーナルの世代を返す
+    """
+    next_generation = snapshot_generation + 1
+    if not os.path.exists(self.journal_file_name):
+      return next_generation
+    # 書き込み途中で終了した行は文字の途中で切れていることがあるので、読めない文字は置き換える
+    with open(self.journal_file_name, encoding="utf-8", errors="replace") as f:
+      reader = csv.reader(f)
+      # 世代の行がない古いジャーナルは1とする
+      journal_generation = 1
+      for row in reader:
+        generation = parse_journal_generation(row)
+        if generation != None:
+          journal_generation = generation
+          continue
+        if journal_generation <= snapshot_generation:
+          # compactの途中で終了した場合で、このジャーナルはスナップショットに反映済み
+          # (次の追記の前に RecordWriter が次の世代のジャーナルに置き換える)
+          return next_generation
+        next_generation = journal_generation
+        # 書き込み途中で終了した行は無視する
+        if len(row) != 9:
+          continue
+        try:
+          result = int(row[4])
+          odds = [float(each_odds) for each_odds in row[5:9]]
+        except ValueError:
+          continue
+        self._apply_fight([self.name_list.to_id(name) for name in row[0:4]], result, odds)
+    return next_generation
+
+
+class FightLog(NamedTuple):
+  """
+  足し合わせる記録の1行分(Record.merge()を参照)
+  names, result_list(引き分けを除く), odds_list は同じ並び順
+  """
+  names: tuple[str, ...]
+  total: int
+  result_list: tuple[int, ...]
+  odds_list: tuple[float, ...]
+
+
+def _to_float(num: str) -> float:
+  try:
+    return float(num)
+  except ValueError:
+    return 0.0
+
+
+def iter_fight_log(file_name: str):
+  """
+  ファイルを先頭から1行ずつ読んで FightLog を返すジェネレータ
+  拡張子が .bin ならバイナリ形式、それ以外はcsvとして読み、
+  列の数でrecord.csvの形式(14列)かジャーナルの形式(9列)かを判断する
+  読めない行は飛ばす
+  csvの先頭にBOMがあれば読み飛ばす(Excelで保存したファイルなど)
+  """
+  if RecordSnapshot.is_snapshot_file_name(file_name):
+    snapshot = RecordSnapshot(file_name)
+    try:
+      name_list = [*snapshot.name_list, ""]
+      def to_name(char_id_in_file: int) -> str:
+        if char_id_in_file == NameList.EMPTY_ID:
+          return ""
+        return name_list[char_id_in_file]
+      for row in snapshot.iter_rows(0, len(snapshot)):
+        yield FightLog(tuple(to_name(char_id) for char_id in row[0:4]),
+                       row[4],
+                       row[5:10],
+                       row[10:14])
+    finally:
+      snapshot.close()
+    return
+
+  with open(file_name, encoding="utf-8-sig") as f:
+    for row in csv.reader(f):
+      fight_log = parse_fight_log_row(row)
+      if fight_log != None:
+        yield fight_log
+
+
+def parse_fight_log_row(row: list[str]) -> FightLog:
+  """
+  csvの1行を FightLog にする
+  列の数でrecord.csvの形式(14列)かジャーナルの形式(9列)かを判断する
+  読めない行はNone
+  """
+  try:
+    if len(row) == 9:
+      result_list = [0] * 5
+      result_list[int(row[4])] = 1
+      return FightLog(tuple(row[0:4]), 1, tuple(result_list),
+                      tuple(float(odds) for odds in row[5:9]))
+    elif 5 <= len(row) <= 14:
+      row = row + [""] * (14 - len(row))
+      return FightLog(tuple(row[0:4]),
+                      int(row[4]),
+                      tuple(int(num) for num in row[5:10]),
+                      tuple(_to_float(num) for num in row[10:14]))
+  except (ValueError, IndexError):
+    pass
+  return None
+
+
+class JournalEntry(NamedTuple):
+  """
+  ジャーナルに追記する1戦分の結果
+  """
+  names: tuple[str, ...]
+  result: int
+  odds: tuple[float, ...]
+
+
+class SnapshotEntry(NamedTuple):
+  """
+  スナップショットの書き出し
+  スナップショットには、その時点で追記しているジャーナルの世代までが含まれる
+  clear_journalがTrueなら、書き出したあと次の世代の空のジャーナルに置き換える
+  """
+  file_name: str
+  name_list: tuple[str, ...]
+  column_list: list[array.array]
+  clear_journal: bool
+
+
+class GenerationEntry(NamedTuple):
+  """
+  読み込んだファイルの世代を RecordWriter に知らせる(Record.reload()を参照)
+  snapshot_generation : スナップショットに含まれているジャーナルの世代
+  journal_generation  : 次に追記するジャーナルの世代
+  """
+  snapshot_generation: int
+  journal_generation: int
+
+
+class BackupEntry(NamedTuple):
+  """
+  ファイルのバックアップ
+  keepがTrueなら timestamp_backup()、Falseなら rotate_backup() で残す
+  """
+  file_name_list: tuple[str, ...]
+  backup_count: int
+  keep: bool
+
+
+class AppendEntry(NamedTuple):
+  """
+  バイナリファイルの末尾への追記(OddsHistoryを参照)
+  targetは追記先で、追記用に開いたファイルを返す open_append() と、
+  追記を終えたときに呼ぶ close_append() を持つもの
+  fsyncはジャーナルと一緒にまとめて行う
+  """
+  target: "OddsHistory"
+  data: bytes
+
+
+class RecordWriter:
+  """
+  Recordのファイルへの書き込みを1本のスレッドでまとめて行う
+  put() で渡したものは渡した順に書き込まれる
+
+  ジャーナルへの追記は、キューにたまっている分をまとめて書いてOSに渡す
+  fsyncは最初の追記から sync_interval 秒後にまとめて1回だけ行う
+  (連続で記録してもfsyncは1回で済み、ボタンの反応も遅れない)
+
+  書き込みに失敗してもスレッドは止めずに後に続く分を書き込み、
+  最初の例外を次の check(), flush(), close() のどれかで投げ直す
+  """
+  # キューにためておける数(いっぱいになるとput()が待たされる)
+  QUEUE_SIZE = 1024
+  # スレッドが止まっていないか確かめる間隔(秒)
+  POLL_INTERVAL = 0.5
+
+  # close()用の目印
+  _STOP = object()
+
+  def __init__(self, journal_file_name: str, sync_interval: float):
+    self.journal_file_name = journal_file_name
+    self.sync_interval = sync_interval
+    self.queue = queue.Queue(self.QUEUE_SIZE)
+    # 追記用に開いたままにしておくジャーナル(最初の追記で開く)
+    self._journal_file = None
+    # 書き出しに成功したスナップショットに含まれているジャーナルの世代と、
+    # 追記するジャーナルの世代(GenerationEntryで受け取り、スナップショットを書き出すと進む)
+    self._snapshot_generation = 0
+    self._journal_generation = 1
+    # AppendEntryの追記先 {AppendEntry.target: 開いたままにしておくファイル}
+    self._append_file_dict = {}
+    # fsyncしていない追記がある場合、最初に追記した時刻
+    self._unsynced_time = None
+    # まだ投げ直していない最初の例外
+    self._error = None
+    self._thread = threading.Thread(target = self._run, name = "RecordWriter", daemon = True)
+    self._thread.start()
+    # close()を呼び忘れても、終了前に書き込みは済ませる
+    atexit.register(self.close)
+
+
+  def put(self, entry):
+    """
+    entryは JournalEntry, SnapshotEntry, BackupEntry, AppendEntry, GenerationEntry のいずれか
+    それまでの書き込みに失敗していても、entryは必ずキューに入れる(例外は check() で知る)
+    スレッドが止まっている場合は RuntimeError を投げる
+    """
+    self._put(entry)
+
+
+  def check(self):
+    """
+    それまでの書き込みに失敗していた場合は、その例外を投げる
+    """
+    self._raise_error()
+
+
+  def flush(self):
+    """
+    それまでに渡したものがすべて書き込まれ、fsyncされるまで待つ
+    それまでの書き込みに失敗していた場合は、その例外を投げる
+    """
+    if self._thread.is_alive():
+      done = threading.Event()
+      self._put(done)
+      # スレッドが止まってしまった場合に待ち続けないよう、ときどき確かめる
+      while not done.wait(self.POLL_INTERVAL):
+        if not self._thread.is_alive():
+          break
+    self._raise_error()
+
+
+  def close(self):
+    """
+    残りを書き込んでスレッドを止める
+    それまでの書き込みに失敗していた場合は、その例外を投げる
+    """
+    if self._thread.is_alive():
+      self._put(self._STOP)
+      self._thread.join()
+    self._raise_error()
+
+
+  def _put(self, entry):
+    while True:
+      if not self._thread.is_alive():
+        raise RuntimeError("RecordWriter is closed")
+      try:
+        self.queue.put(entry, timeout = self.POLL_INTERVAL)
+        return
+      except queue.Full:
+        pass
+
+
+  def _raise_error(self):
+    error = self._error
+    if error != None:
+      self._error = None
+      raise error
+
+
+  def _set_error(self, error: Exception):
+    # 書き込みに失敗しても、後に続く分は書き込む
+    traceback.print_exc(file = sys.stderr)
+    if self._error == None:
+      self._error = error
+
+
+  def _run(self):
+    while True:
+      if self._unsynced_time == None:
+        timeout = None
+      else:
+        timeout = max(0.0, self._unsynced_time + self.sync_interval - time.monotonic())
+      try:
+        entry_list = [self.queue.get(timeout = timeout)]
+      except queue.Empty:
+        try:
+          self._sync()
+        except Exception as error:
+          self._set_error(error)
+        continue
+      # たまっている分はまとめて処理する
+      while True:
+        try:
+          entry_list.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+
+      stop = False
+      try:
+        for entry in entry_list:
+          if entry is self._STOP:
+            stop = True
+          try:
+            self._write(entry)
+          except Exception as error:
+            self._set_error(error)
+        try:
+          if self._journal_file != None:
+            self._journal_file.flush()
+          for append_file in self._append_file_dict.values():
+            append_file.flush()
+        except Exception as error:
+          self._set_error(error)
+      finally:
+        # flush()で待っているものに終わったことを知らせる
+        for entry in entry_list:
+          if isinstance(entry, threading.Event):
+            entry.set()
+      if stop:
+        return
+
+
+  def _write(self, entry):
+    """
+    entryを1つ書き込む
+    """
+    if isinstance(entry, JournalEntry):
+      self._open_journal()
+      writer = csv.writer(self._journal_file)
+      writer.writerow([*entry.names, entry.result, *entry.odds])
+      if self._unsynced_time == None:
+        self._unsynced_time = time.monotonic()
+    elif isinstance(entry, AppendEntry):
+      append_file = self._append_file_dict.get(entry.target)
+      if append_file == None:
+        append_file = entry.target.open_append()
+        self._append_file_dict[entry.target] = append_file
+      append_file.write(entry.data)
+      if self._unsynced_time == None:
+        self._unsynced_time = time.monotonic()
+    elif isinstance(entry, SnapshotEntry):
+      self._write_snapshot(entry)
+    elif isinstance(entry, GenerationEntry):
+      self._close_journal()
+      self._snapshot_generation = entry.snapshot_generation
+      self._journal_generation = entry.journal_generation
+    elif isinstance(entry, BackupEntry):
+      if self._journal_file != None:
+        self._journal_file.flush()
+      if entry.keep:
+        timestamp_backup(entry.file_name_list)
+      else:
+        for file_name in entry.file_name_list:
+          rotate_backup(file_name, entry.backup_count)
+    elif isinstance(entry, threading.Event):
+      self._sync()
+    elif entry is self._STOP:
+      target_list = list(self._append_file_dict)
+      try:
+        self._close_journal()
+      finally:
+        for append_file in self._append_file_dict.values():
+          append_file.close()
+        self._append_file_dict.clear()
+      for target in target_list:
+        target.close_append()
+
+
+  def _write_snapshot(self, entry: SnapshotEntry):
+    generation = self._journal_generation
+    write_snapshot_file(entry.file_name, entry.name_list, entry.column_list, generation)
+    if entry.clear_journal:
+      # 書き出しに失敗した場合はここまで来ないので、世代は進まず同じジャーナルに追記を続ける
+      # ここで終了しても、読み込み時には世代を見てこのジャーナルを再生しない
+      self._close_journal()
+      self._snapshot_generation = generation
+      self._journal_generation = generation + 1
+      self._reset_journal(self._journal_generation)
+
+
+  def _open_journal(self):
+    """
+    ジャーナルを追記用に開く
+    ファイルがないか、スナップショットに反映済みの世代のもの(compactの途中で終了して
+    残ったもの)なら、空にしてから開く
+    """
+    if self._journal_file != None:
+      return
+    generation = read_journal_generation(self.journal_file_name)
+    if generation == None or generation <= self._snapshot_generation:
+      self._reset_journal(self._journal_generation)
+    else:
+      # まだスナップショットに含まれていないジャーナルは消さずに続きに追記する
+      self._journal_generation = generation
+      self._truncate_partial_line()
+    self._journal_file = open(self.journal_file_name, 'a', encoding="utf-8", newline="")
+
+
+  def _truncate_partial_line(self):
+    """
+    書き込み途中で終了した行(改行で終わっていない末尾)があれば切り捨てる
+    そのまま追記すると、次の行がつながって読み込み時に飛ばされてしまう
+    """
+    with open(self.journal_file_name, 'rb+') as f:
+      size = f.seek(0, os.SEEK_END)
+      end = size
+      while end > 0:
+        start = max(0, end - 4096)
+        f.seek(start)
+        block = f.read(end - start)
+        newline_index = block.rfind(b"\n")
+        if newline_index != -1:
+          end = start + newline_index + 1
+          break
+        end = start
+      if end != size:
+        f.truncate(end)
+
+
+  def _reset_journal(self, generation: int):
+    # 世代の行だけのジャーナルにする
+    with atomic_open(self.journal_file_name, 'w', encoding="utf-8", newline="") as f:
+      csv.writer(f).writerow([JOURNAL_GENERATION_TAG, generation])
+
+
+  def _sync(self):
+    # 失敗しても同じfsyncを繰り返さないよう、先に印を消す
+    self._unsynced_time = None
+    for f in [self._journal_file, *self._append_file_dict.values()]:
+      if f != None:
+        f.flush()
+        os.fsync(f.fileno())
+
+
+  def _close_journal(self):
+    self._sync()
+    if self._journal_file != None:
+      self._journal_file.close()
+      self._journal_file = None
+
+
+class OddsHistory:
+  """
+  対戦カードごとのオッズの履歴
+  record.csvには最後のオッズしか残らないので、1戦ごとに
+  (時刻, オッズx4, 結果) を固定長でファイルの末尾に追記していく
+
+  対戦カードはキャラ名を並べ替えたものをblake2bで8バイトにしたキーで区別し、
+  オッズと結果もその並び(キャラ名の順)で保存する
+  (char_name.csvを編集してもキーは変わらない)
+
+  索引(キーの小さい順に並べた [キー, 何件目か])は record_odds.idx のような別のファイルに持ち、
+  追記を終えたとき(close_append())に作り直す
+  開くときはファイルの大きさを見るだけで、索引は最初に履歴を引いたときに読み込む
+  1つの対戦カードの履歴は、索引で調べた位置の分だけをファイルから読む
+  (索引を作ったあとに追記された分は、最初に履歴を引いたときにまとめて読む)
+
+  ファイルへの追記は、open_append() で開いたファイルに1つのスレッドからだけ行う
+  書き込み途中で終了した分を切り捨てるのも open_append() だけなので、
+  読むだけなら追記している最中のファイルを開いてもよい
+  """
+  MAGIC = b"DPOH"
+  VERSION = 1
+  HEADER_STRUCT = struct.Struct("<4sH")
+  # キー, 時刻, オッズx4(float32), 結果(0~3はキャラの位置、4は引き分け)
+  ENTRY_STRUCT = struct.Struct("<8sd4fB")
+  INDEX_MAGIC = b"DPOI"
+  INDEX_VERSION = 1
+  # マジックナンバー, バージョン, 索引に含まれている件数
+  # そのあとにキー(8バイトを整数にしたもの)の列と、何件目かの列が続く
+  INDEX_HEADER_STRUCT = struct.Struct("<4sHI")
+
+  def __init__(self, file_name: str, index_file_name: str = None):
+    self.file_name = file_name
+    if index_file_name == None:
+      index_file_name = os.path.splitext(file_name)[0] + ".idx"
+    self.index_file_name = index_file_name
+
+    size = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+    self._header_written = size >= self.HEADER_STRUCT.size
+    # 開いた時点でファイルにあった件数(書き込み途中のものは数えない)
+    self._file_count = 0
+    if self._header_written:
+      with open(file_name, 'rb') as f:
+        magic, version = self.HEADER_STRUCT.unpack(f.read(self.HEADER_STRUCT.size))
+      if magic != self.MAGIC or version != self.VERSION:
+        raise ValueError("{} is not an odds history file".format(file_name))
+      self._file_count = (size - self.HEADER_STRUCT.size) // self.ENTRY_STRUCT.size
+    # add() した分も含めた件数
+    self._count = self._file_count
+
+    # 索引は _load() で読み込む
+    self._loaded = False
+    self._indexed_count = 0
+    self._index_key_column = array.array('Q')
+    self._index_position_column = array.array('I')
+    # 索引に含まれていない分 {キー: [(何件目か, 時刻, オッズx4, 結果)]}
+    self._tail_dict = {}
+
+
+  def __len__(self):
+    return self._count
+
+
+  @staticmethod
+  def canonical_slot_list(names: list[str]) -> list[int]:
+    """
+    namesの各キャラが、キャラ名の順に並べたときに何番目に来るか
+    """
+    sorted_index_list = sorted(range(len(names)), key = lambda i: names[i])
+    slot_list = [0] * len(names)
+    for i in range(len(names)):
+      slot_list[sorted_index_list[i]] = i
+    return slot_list
+
+
+  @staticmethod
+  def make_key(names: list[str]) -> bytes:
+    return hashlib.blake2b("\x1f".join(sorted(names)).encode("utf-8"), digest_size = 8).digest()
+
+
+  def add(self, names: list[str], odds: list[float], result: int, timestamp: float) -> bytes:
+    """
+    1戦分を加え、ファイルに追記するバイト列を返す
+    names, odds, result(0~3、引き分けは4) は同じ並び順ならどの順でもよい
+    """
+    slot_list = self.canonical_slot_list(names)
+    canonical_odds = [0.0] * 4
+    for i in range(4):
+      canonical_odds[slot_list[i]] = odds[i]
+    canonical_result = 4 if result == 4 else slot_list[result]
+    key = self.make_key(names)
+
+    data = self.ENTRY_STRUCT.pack(key, timestamp, *canonical_odds, canonical_result)
+    # ファイルから読んだ場合と同じ値(オッズはfloat32)で持つ
+    _, timestamp, *entry = self.ENTRY_STRUCT.unpack(data)
+    self._tail_dict.setdefault(key, []).append((self._count, timestamp, tuple(entry[0:4]), entry[4]))
+    self._count += 1
+    if not self._header_written:
+      self._header_written = True
+      data = self.HEADER_STRUCT.pack(self.MAGIC, self.VERSION) + data
+    return data
+
+
+  def count(self, names: list[str]) -> int:
+    key = self.make_key(names)
+    self._load()
+    start, end = self._index_range(key)
+    return end - start + len(self._tail_dict.get(key, ()))
+
+
+  def history(self, names: list[str]) -> list[tuple[float, list[float], int]]:
+    """
+    対戦カードの履歴を古い順に [(時刻, オッズx4, 結果)] で返す
+    オッズと結果はnamesの並び順
+    """
+    slot_list = self.canonical_slot_list(names)
+    reverse_slot_list = [0] * 4
+    for i in range(4):
+      reverse_slot_list[slot_list[i]] = i
+    return [(timestamp,
+             [odds[slot_list[i]] for i in range(4)],
+             4 if result == 4 else reverse_slot_list[result])
+            for timestamp, odds, result in self._entries(self.make_key(names))]
+
+
+  def mean_odds(self, names: list[str], slot: int) -> float:
+    """
+    namesのslot番目のキャラに付いたオッズの平均(履歴がなければ0)
+    """
+    canonical_slot = self.canonical_slot_list(names)[slot]
+    entry_list = self._entries(self.make_key(names))
+    return stats_module.ratio(sum(odds[canonical_slot] for timestamp, odds, result in entry_list),
+                              len(entry_list))
+
+
+  def historical_rtp(self, names: list[str], slot: int) -> float:
+    """
+    namesのslot番目のキャラに毎回1ずつ賭けていた場合の実際のリターン率
+    勝てばその時のオッズ、引き分けなら掛け金が戻ってくる
+    """
+    canonical_slot = self.canonical_slot_list(names)[slot]
+    entry_list = self._entries(self.make_key(names))
+    return_sum = 0.0
+    for timestamp, odds, result in entry_list:
+      if result == canonical_slot:
+        return_sum += odds[canonical_slot]
+      elif result == 4:
+        return_sum += 1.0
+    return stats_module.ratio(return_sum, len(entry_list))
+
+
+  def open_append(self):
+    """
+    ファイルを追記用に開く
+    書き込み途中で終了した分(固定長に満たない末尾)があれば、切り捨ててから開く
+    """
+    if os.path.exists(self.file_name):
+      size = os.path.getsize(self.file_name)
+      if size < self.HEADER_STRUCT.size:
+        valid_size = 0
+      else:
+        valid_size = size - (size - self.HEADER_STRUCT.size) % self.ENTRY_STRUCT.size
+      if valid_size != size:
+        os.truncate(self.file_name, valid_size)
+    return open(self.file_name, 'ab')
+
+
+  def close_append(self):
+    """
+    追記を終えたときに呼ぶ
+    索引に含まれていない分があれば、索引を作り直して保存する
+    """
+    if self._count == 0 or (self._loaded and self._indexed_count == self._count):
+      return
+    self._load()
+    if self._indexed_count == self._count:
+      return
+    tail_list = sorted((int.from_bytes(key, "little"), position)
+                       for key, entry_list in self._tail_dict.items()
+                       for position, *entry in entry_list)
+    pair_list = list(heapq.merge(zip(self._index_key_column, self._index_position_column),
+                                 tail_list))
+    key_column = array.array('Q', (key for key, position in pair_list))
+    position_column = array.array('I', (position for key, position in pair_list))
+
+    file_key_column = array.array('Q', key_column)
+    file_position_column = array.array('I', position_column)
+    if sys.byteorder == "big":
+      file_key_column.byteswap()
+      file_position_column.byteswap()
+    with atomic_open(self.index_file_name, 'wb') as f:
+      f.write(self.INDEX_HEADER_STRUCT.pack(self.INDEX_MAGIC, self.INDEX_VERSION, len(pair_list)))
+      f.write(file_key_column.tobytes())
+      f.write(file_position_column.tobytes())
+
+    self._index_key_column = key_column
+    self._index_position_column = position_column
+    self._indexed_count = len(pair_list)
+    self._tail_dict = {}
+
+
+  def _load(self):
+    """
+    索引と、索引に含まれていない分を読み込む(最初の1回だけ)
+    """
+    if self._loaded:
+      return
+    self._loaded = True
+
+    if os.path.exists(self.index_file_name):
+      with open(self.index_file_name, 'rb') as f:
+        data = f.read()
+      if len(data) >= self.INDEX_HEADER_STRUCT.size:
+        magic, version, count = self.INDEX_HEADER_STRUCT.unpack_from(data)
+        key_end = self.INDEX_HEADER_STRUCT.size + 8 * count
+        # 履歴のファイルより新しい索引(履歴のファイルを戻した場合など)は使わない
+        if (magic == self.INDEX_MAGIC and version == self.INDEX_VERSION
+            and count <= self._file_count and len(data) == key_end + 4 * count):
+          self._index_key_column.frombytes(data[self.INDEX_HEADER_STRUCT.size:key_end])
+          self._index_position_column.frombytes(data[key_end:])
+          if sys.byteorder == "big":
+            self._index_key_column.byteswap()
+            self._index_position_column.byteswap()
+          self._indexed_count = count
+
+    tail_dict = {}
+    if self._indexed_count < self._file_count:
+      with open(self.file_name, 'rb') as f:
+        f.seek(self.HEADER_STRUCT.size + self._indexed_count * self.ENTRY_STRUCT.size)
+        data = f.read((self._file_count - self._indexed_count) * self.ENTRY_STRUCT.size)
+      data = data[:len(data) - len(data) % self.ENTRY_STRUCT.size]
+      for position, (key, timestamp, *entry) in enumerate(self.ENTRY_STRUCT.iter_unpack(data),
+                                                          self._indexed_count):
+        tail_dict.setdefault(key, []).append((position, timestamp, tuple(entry[0:4]), entry[4]))
+    # 開いたあとに add() した分はその後ろに付ける
+    for key, entry_list in self._tail_dict.items():
+      tail_dict.setdefault(key, []).extend(entry_list)
+    self._tail_dict = tail_dict
+
+
+  def _index_range(self, key: bytes) -> tuple[int, int]:
+    packed_key = int.from_bytes(key, "little")
+    return (bisect.bisect_left(self._index_key_column, packed_key),
+            bisect.bisect_right(self._index_key_column, packed_key))
+
+
+  def _entries(self, key: bytes) -> list[tuple[float, tuple[float, ...], int]]:
+    """
+    対戦カードの履歴を古い順に [(時刻, オッズx4, 結果)] で返す(キャラ名の順)
+    """
+    self._load()
+    start, end = self._index_range(key)
+    entry_list = []
+    if start < end:
+      with open(self.file_name, 'rb') as f:
+        for i in range(start, end):
+          f.seek(self.HEADER_STRUCT.size + self._index_position_column[i] * self.ENTRY_STRUCT.size)
+          _, timestamp, *entry = self.ENTRY_STRUCT.unpack(f.read(self.ENTRY_STRUCT.size))
+          entry_list.append((timestamp, tuple(entry[0:4]), entry[4]))
+    entry_list.extend((timestamp, odds, result)
+                      for position, timestamp, odds, result in self._tail_dict.get(key, ()))
+    return entry_list
+
+
+class RecordCursor:
+  """
+  Recordの行を、並び順と絞り込みの条件に従って番号(0から)で参照するためのカーソル
+  並び順は最初に参照されたときに作り、Recordが変化したら作り直す
+  一度作れば、どの番号の行も定数時間で引ける
+  """
+  ORDER_RECORD  = 1  # 記録順
+  ORDER_TOTAL   = 2  # 試合数の多い順
+  ORDER_RTP     = 3  # 記録されているオッズでのリターン率が高い順
+
+  def __init__(self, record: Record, order: int = ORDER_RECORD, char_id: int = None):
+    """
+    char_idを指定した場合は、そのキャラを含む対戦カードだけに絞り込む
+    """
+    self.record = record
+    self.order = order
+    self.char_id = char_id
+    self._row_index_list = None
+    self._version = None
+
+
+  def __len__(self):
+    if self.order == self.ORDER_RECORD and self.char_id == None:
+      return len(self.record)
+    return len(self._get_row_index_list())
+
+
+  def row_index(self, position: int) -> int:
+    """
+    position番目の行の行番号
+    """
+    if self.order == self.ORDER_RECORD and self.char_id == None:
+      return position
+    return self._get_row_index_list()[position]
+
+
+  def _get_row_index_list(self) -> list[int]:
+    if self._version != self.record.version:
+      if self.char_id == None:
+        row_index_list = list(range(len(self.record)))
+      else:
+        row_index_list = sorted(self.record.row_index_set(self.char_id))
+
+      if self.order == self.ORDER_TOTAL:
+        total_column = self.record.total_column
+        row_index_list.sort(key = lambda i: total_column[i], reverse = True)
+      elif self.order == self.ORDER_RTP:
+        rtp_column_list = stats_module.all_rtp_column_list(self.record)
+        row_index_list.sort(key = lambda i: max(rtp_column[i] for rtp_column in rtp_column_list),
+                            reverse = True)
+
+      self._row_index_list = row_index_list
+      self._version = self.record.version
+    return self._row_index_list
+
+
+class RecordSnapshot:
+  """
+  戦績データのバイナリ形式
+  [ヘッダ][キャラ名一覧][列x14][索引]
+
+  列は [キャラidx4, 試合数, 勝利数x4, 引き分け数, オッズx4] の順で、
+  それぞれ行数分の値を続けて並べる(1列を array.frombytes 1回で読み込める)
+  キャラidはこのファイルのキャラ名一覧の番号(空欄はNameList.EMPTY_ID)
+  索引は対戦カードのキー(pack_key())を小さい順に並べた列と、それぞれの行番号の列
+  数値はすべてリトルエンディアン
+  ヘッダには、このファイルに含まれているジャーナルの世代も書く(Recordを参照)
+
+  列は column_list で最初に参照されたときにまとめて読み込む
+  一部の行だけが必要なら iter_rows() を使うと、その範囲だけを読み込む
+
+  VERSION 1, 2 の行ごとの形式([固定長の行 x 行数])も読める
+  その場合 column_list はNoneで、行は row() で参照されたときに初めてデコードされる
+  """
+  FILE_EXTENSION = ".bin"
+  MAGIC = b"DPAR"
+  VERSION = 3
+  # マジックナンバー, バージョン, キャラ名の数, 行数, ジャーナルの世代
+  HEADER_STRUCT = struct.Struct("<4sHIII")
+  # VERSION 1 のヘッダ(ジャーナルの世代がない)
+  HEADER_STRUCT_V1 = struct.Struct("<4sHII")
+  NAME_LENGTH_STRUCT = struct.Struct("<H")
+  # 各列のarrayの型
+  COLUMN_TYPECODE_LIST = ['H'] * 4 + ['I'] + ['I'] * 5 + ['d'] * 4
+  # 索引のキーと行番号の型
+  KEY_TYPECODE = 'Q'
+  KEY_ROW_TYPECODE = 'I'
+  # 1行分の列のバイト数(索引を除く)
+  ROW_SIZE = sum(map(lambda typecode: array.array(typecode).itemsize, COLUMN_TYPECODE_LIST))
+  # VERSION 1, 2 の1行
+  ROW_STRUCT = struct.Struct("<4HI5I4d")
+
+  def __init__(self, file_name: str):
+    self._file = open(file_name, 'rb')
+    self._mmap = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    magic, version = struct.unpack_from("<4sH", self._mmap, 0)
+    if magic != self.MAGIC or version not in (1, 2, self.VERSION):
+      self.close()
+      raise ValueError(file_name + " is not a record snapshot")
+    if version == 1:
+      _, _, name_count, self.row_count = self.HEADER_STRUCT_V1.unpack_from(self._mmap, 0)
+      self.journal_generation = 0
+      offset = self.HEADER_STRUCT_V1.size
+    else:
+      (_, _, name_count, self.row_count,
+       self.journal_generation) = self.HEADER_STRUCT.unpack_from(self._mmap, 0)
+      offset = self.HEADER_STRUCT.size
+
+    self.name_list = []
+    for i in range(name_count):
+      (length,) = self.NAME_LENGTH_STRUCT.unpack_from(self._mmap, offset)
+      offset += self.NAME_LENGTH_STRUCT.size
+      self.name_list.append(self._mmap[offset:offset+length].decode("utf-8"))
+      offset += length
+    self._row_offset = offset
+
+    # 列ごとの [型, 先頭の位置] (行ごとの古い形式の場合はNone)
+    self._column_layout_list = None
+    # 読み込んだ全列(column_listを参照)
+    self._column_list = None
+    if version == self.VERSION:
+      self._column_layout_list = []
+      for typecode in [*self.COLUMN_TYPECODE_LIST, self.KEY_TYPECODE, self.KEY_ROW_TYPECODE]:
+        self._column_layout_list.append((typecode, offset))
+        offset += array.array(typecode).itemsize * self.row_count
+
+
+  def __len__(self):
+    return self.row_count
+
+
+  @property
+  def column_list(self) -> list[array.array]:
+    """
+    [キャラidの列x4, 試合数の列, 勝利数の列x4, 引き分け数の列, オッズの列x4]
+    行ごとの古い形式の場合はNone
+    """
+    if self._column_list == None and self._column_layout_list != None:
+      self._column_list = self._read_column_list(0, self.row_count)
+    return self._column_list
+
+
+  def row(self, row_index: int) -> tuple:
+    """
+    [キャラidx4, 試合数, 勝利数x4, 引き分け数, オッズx4]
+    """
+    if self._column_list != None:
+      return tuple(column[row_index] for column in self._column_list)
+    if self._column_layout_list != None:
+      return tuple(struct.unpack_from("<" + typecode, self._mmap,
+                                      offset + struct.calcsize(typecode) * row_index)[0]
+                   for typecode, offset in self._column_layout_list[0:14])
+    return self.ROW_STRUCT.unpack_from(self._mmap,
+                                       self._row_offset + self.ROW_STRUCT.size * row_index)
+
+
+  def iter_rows(self, start: int, end: int):
+    """
+    start行目からend行目の手前までの row() を順に返すジェネレータ
+    列の形式では、その範囲だけを読み込む
+    """
+    if self._column_list == None and self._column_layout_list != None:
+      yield from zip(*self._read_column_list(start, end))
+      return
+    for i in range(start, end):
+      yield self.row(i)
+
+
+  def key_index(self) -> "SnapshotIndex":
+    """
+    保存されている索引(行ごとの古い形式の場合はNone)
+    """
+    if self._column_layout_list == None:
+      return None
+    key_column, key_row_column = self._read_column_list(0, self.row_count, 14, 16)
+    return SnapshotIndex(key_column, key_row_column)
+
+
+  def _read_column_list(self, start: int, end: int,
+                        first_column: int = 0, last_column: int = 14) -> list[array.array]:
+    # first_column番目からlast_column番目の手前までの列の、start行目からend行目の手前まで
+    column_list = []
+    with memoryview(self._mmap) as view:
+      for typecode, offset in self._column_layout_list[first_column:last_column]:
+        column = array.array(typecode)
+        column.frombytes(view[offset + column.itemsize * start:offset + column.itemsize * end])
+        if sys.byteorder == "big":
+          column.byteswap()
+        column_list.append(column)
+    return column_list
+
+
+  def close(self):
+    self._mmap.close()
+    self._file.close()
+
+
+  @staticmethod
+  def pack_key(key: tuple[int]) -> int:
+    """
+    Record.make_key() のキー(並べ替えたキャラidx4)を1つの整数にする
+    """
+    return (key[0] << 48) | (key[1] << 32) | (key[2] << 16) | key[3]
+
+
+  @classmethod
+  def is_snapshot_file_name(cls, file_name: str) -> bool:
+    return os.path.splitext(file_name)[1] == cls.FILE_EXTENSION
+
+
+  @classmethod
+  def write(cls, file_name: str, name_list: list[str], column_list: list,
+            journal_generation: int = 0):
+    """
+    column_listは [キャラidの列x4, 試合数の列, 勝利数の列x4, 引き分け数の列, オッズの列x4]
+    journal_generationはこのファイルに含まれているジャーナルの世代
+    """
+    column_list = [array.array(typecode, column)
+                   for typecode, column in zip(cls.COLUMN_TYPECODE_LIST, column_list)]
+    row_count = len(column_list[4])
+    # 同じ対戦カードが複数行あれば、行番号の小さい方が先に来る
+    key_list = sorted((cls.pack_key(sorted(id_list)), row_index)
+                      for row_index, id_list in enumerate(zip(*column_list[0:4])))
+    column_list.append(array.array(cls.KEY_TYPECODE, (key for key, row_index in key_list)))
+    column_list.append(array.array(cls.KEY_ROW_TYPECODE, (row_index for key, row_index in key_list)))
+    if sys.byteorder == "big":
+      for column in column_list:
+        column.byteswap()
+
+    with atomic_open(file_name, 'wb') as f:
+      f.write(cls.HEADER_STRUCT.pack(cls.MAGIC,
+                                     cls.VERSION,
+                                     len(name_list),
+                                     row_count,
+                                     journal_generation))
+      for name in name_list:
+        encoded_name = name.encode("utf-8")
+        f.write(cls.NAME_LENGTH_STRUCT.pack(len(encoded_name)))
+        f.write(encoded_name)
+      for column in column_list:
+        f.write(column.tobytes())
+
+
+class SnapshotIndex:
+  """
+  RecordSnapshot に保存されている索引
+  キーの列を二分探索して、対戦カードの行番号を引く
+  """
+  def __init__(self, key_column: array.array, row_column: array.array):
+    self.key_column = key_column
+    self.row_column = row_column
+
+
+  def __len__(self):
+    return len(self.key_column)
+
+
+  def get(self, key: tuple[int]) -> int:
+    """
+    Record.make_key() のキーの行番号(なければNone)
+    """
+    packed_key = RecordSnapshot.pack_key(key)
+    i = bisect.bisect_left(self.key_column, packed_key)
+    if i < len(self.key_column) and self.key_column[i] == packed_key:
+      return self.row_column[i]
+    return None
+
+
+class RecordRow:
+  """
+  Recordの1行分を行形式で読むためのビュー
+  値は参照したときに列から取り出す
+  """
+  def __init__(self, record: Record, row_index: int):
+    self.record = record
+    self.index = row_index
+
+  @property
+  def id_list(self) -> list[int]:
+    return self.record.row_id_list(self.index)
+
+  @property
+  def names(self) -> list[str]:
+    return [self.record.name_list.to_name(char_id) for char_id in self.id_list]
+
+  @property
+  def total(self) -> int:
+    return self.record.total_column[self.index]
+
+  @property
+  def win_list(self) -> list[int]:
+    return [self.record.result_column_list[i][self.index] for i in range(4)]
+
+  @property
+  def draw(self) -> int:
+    return self.record.result_column_list[4][self.index]
+
+  @property
+  def odds_list(self) -> list[float]:
+    return [self.record.odds_column_list[i][self.index] for i in range(4)]
 
 
 class NameList:
+  """
+  キャラ名の一覧
+  キャラ名はidに置き換えて扱う
+  idはchar_name.csvの行番号で、一覧にないキャラにはそれ以降の番号を割り当てる
+  """
+  # 空欄のid(どのキャラよりも後ろに並ぶ)
+  EMPTY_ID = 0xFFFF
+
   def __init__(self, FILE_NAME: str):
     with open(FILE_NAME, encoding="utf-8") as f:
       reader = csv.reader(f)
       self.data = [row for row in reader]
-  
+
+    self.name_list = [row[0] for row in self.data]
+    self.id_dict = {}
+    for i in range(len(self.name_list)):
+      self.id_dict.setdefault(self.name_list[i], i)
+
+
+  def to_id(self, name: str) -> int:
+    """
+    キャラ名をidに変換する
+    一覧にないキャラは新しくidを割り当てる
+    """
+    if name == "":
+      return self.EMPTY_ID
+    char_id = self.id_dict.get(name)
+    if char_id == None:
+      char_id = len(self.name_list)
+      self.name_list.append(name)
+      self.id_dict[name] = char_id
+    return char_id
+
+
+  def to_name(self, char_id: int) -> str:
+    if char_id == self.EMPTY_ID:
+      return ""
+    return self.name_list[char_id]
+
+
+  def is_listed(self, char_id: int) -> bool:
+    """
+    char_name.csvに載っている(ボタンがある)キャラかどうか
+    """
+    return char_id < len(self.data)
+
 
 class Image:
   def __init__(self, FILE_NAME: str):
-    self.data = tkinter.PhotoImage(file = FILE_NAME)
\ No newline at end of file
+    self.data = tkinter.PhotoImage(file = FILE_NAME)
+
+
+class ImageCache:
+  """
+  読み込んだ画像をファイルごとに保持して使い回す
+  ファイルが更新された場合は読み込み直す
+  """
+  def __init__(self):
+    # {ファイルのパス: (更新日時, 画像)}
+    self._image_dict = {}
+
+  def get(self, file_name: str) -> tkinter.PhotoImage:
+    path = os.path.abspath(file_name)
+    mtime = os.path.getmtime(path)
+    cached = self._image_dict.get(path)
+    if cached == None or cached[0] != mtime:
+      cached = (mtime, Image(file_name).data)
+      self._image_dict[path] = cached
+    return cached[1]
+
+
+# 画像は全てここから読み込むこと
+image_cache = ImageCache()
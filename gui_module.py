@@ -27,33 +27,48 @@ class Window:
     self.mouse_y = 0
     self.mouse_c = False
 
-    self._refreshing = False
+    self._refresh_function = None
+    self._refresh_requested = False
 
+    self._close_callback_list = []
+    self.root.protocol("WM_DELETE_WINDOW", self._close)
 
-  def start_refresh_loop(
-      self,
-      refresh_loop_function: Callable,
-      loop_distance_ms: int,
-      ):
-    self._refreshing = True
-    self._refresh_loop(refresh_loop_function, loop_distance_ms)
 
-  def stop_refresh_loop(self):
-    self.refreshing = False
+  def set_refresh_function(self, refresh_function: Callable):
+    """
+    request_refresh() が呼ばれたときに実行する関数を設定する
+    """
+    self._refresh_function = refresh_function
 
-  
-  def _refresh_loop(
-      self,
-      refresh_loop_function: Callable,
-      loop_distance_ms: int,
-      ):
-    
-    if self._refreshing :
-      refresh_loop_function()
-      self.root.after(
-        loop_distance_ms,
-        lambda : self._refresh_loop(refresh_loop_function, loop_distance_ms)
-        )
+  def request_refresh(self):
+    """
+    Tkのイベント処理が一段落したときに refresh_function を1回だけ実行する
+    実行されるまでに何度呼ばれても実行は1回にまとめられる
+    """
+    if not self._refresh_requested:
+      self._refresh_requested = True
+      self.root.after_idle(self._refresh)
+
+
+  def _refresh(self):
+    self._refresh_requested = False
+    if self._refresh_function != None:
+      self._refresh_function()
+
+
+  def add_close_callback(self, close_callback: Callable):
+    """
+    ウィンドウを閉じるときに実行する関数を追加する
+    追加した順に実行してからウィンドウを破棄する
+    """
+    self._close_callback_list.append(close_callback)
+
+  def _close(self):
+    try:
+      for close_callback in self._close_callback_list:
+        close_callback()
+    finally:
+      self.root.destroy()
 
     
   def _mouse_move(self, event):
@@ -94,3 +109,53 @@ class WindowObject:
   def destroy(self):
     self.window_object.destroy()
     self.state = self.UNLOADED
+
+
+class WindowObjectRegistry:
+  """
+  WindowObjectをidで管理する
+  破棄されたWindowObjectは登録から外すので、いくら画面を切り替えても大きくならない
+  """
+  def __init__(self):
+    self._object_dict = {}
+
+  def __len__(self):
+    return len(self._object_dict)
+
+  def append(self, window_object: WindowObject):
+    self._object_dict[window_object.id] = window_object
+
+  def extend(self, window_object_list: list[WindowObject]):
+    for each_object in window_object_list:
+      self.append(each_object)
+
+  def get(self, id: int) -> WindowObject:
+    return self._object_dict.get(id)
+
+  def process(
+      self,
+      display_id_list: list[int],
+      forget_id_list: list[int],
+      destroy_id_list: list[int],
+      ):
+    """
+    表示・非表示・破棄の待ち行列を処理して空にする
+    処理にかかる時間は待ち行列の長さにのみ比例する
+    """
+    for each_id in display_id_list:
+      each_object = self._object_dict.get(each_id)
+      if each_object != None and each_object.state in (WindowObject.UNLOADED, WindowObject.HIDDEN):
+        each_object.display()
+    display_id_list.clear()
+
+    for each_id in forget_id_list:
+      each_object = self._object_dict.get(each_id)
+      if each_object != None and each_object.state == WindowObject.DISPLAYING:
+        each_object.forget()
+    forget_id_list.clear()
+
+    for each_id in destroy_id_list:
+      each_object = self._object_dict.pop(each_id, None)
+      if each_object != None:
+        each_object.destroy()
+    destroy_id_list.clear()
@@ -1,5 +1,7 @@
 import data_module
 import gui_module
+import sqlite_module
+import stats_module
 import ui_module
 import tkinter
 import copy
@@ -9,16 +11,16 @@ CHAR_FILE_NAME = "char_name.csv"
 RECORD_FILE_NAME = "record.csv"
 
 
-# [0]から順に描画
-# 背景は[0]に指定した方がいい
-window_object_list = []
+# display_id_listに入れた順に描画
+# 背景は最初に入れた方がいい
+window_object_registry = gui_module.WindowObjectRegistry()
 display_id_list = []
 forget_id_list = []
 destroy_id_list = []
 
 
 def refresh(
-    window_object_list: list[gui_module.WindowObject],
+    window_object_registry: gui_module.WindowObjectRegistry,
     display_id_list: list[int],
     forget_id_list: list[int],
     destroy_id_list: list[int],
@@ -29,7 +31,7 @@ def refresh(
     ):
 
   routine.execute(root,
-                  window_object_list,
+                  window_object_registry,
                   display_id_list,
                   forget_id_list,
                   destroy_id_list,
@@ -37,58 +39,39 @@ def refresh(
                   record)
 
 
-  finished_id_list = []
-  for each_id in display_id_list:
-    for each_object in window_object_list:
-      if each_id == each_object.id:
-        if each_object.state in (gui_module.WindowObject.UNLOADED, gui_module.WindowObject.HIDDEN):
-          each_object.display()
-          each_object.state = gui_module.WindowObject.DISPLAYING
-          finished_id_list.append(each_id)
-  for each_id in finished_id_list:
-    display_id_list.remove(each_id)
+  window_object_registry.process(display_id_list,
+                                 forget_id_list,
+                                 destroy_id_list)
 
-  finished_id_list = []
-  for each_id in forget_id_list:
-    for each_object in window_object_list:
-      if each_id == each_object.id:
-        if each_object.state == gui_module.WindowObject.DISPLAYING:
-          each_object.forget()
-          each_object.state = gui_module.WindowObject.HIDDEN
-          finished_id_list.append(each_id)
-  for each_id in finished_id_list:
-    forget_id_list.remove(each_id)
 
-  finished_id_list = []
-  for each_id in destroy_id_list:
-    for each_object in window_object_list:
-      if each_id == each_object.id:
-        each_object.destroy()
-        finished_id_list.append(each_id)
-  for each_id in finished_id_list:
-    destroy_id_list.remove(each_id)
 
-
-
-char_name_list = data_module.NameList(CHAR_FILE_NAME)
-record = data_module.Record(RECORD_FILE_NAME)
+if sqlite_module.SQLiteRecord.is_database_file_name(RECORD_FILE_NAME):
+  # キャラ一覧もデータベースに入っている
+  char_name_list = sqlite_module.SQLiteNameList(RECORD_FILE_NAME)
+  record = sqlite_module.SQLiteRecord(RECORD_FILE_NAME, char_name_list)
+else:
+  char_name_list = data_module.NameList(CHAR_FILE_NAME)
+  record = data_module.Record(RECORD_FILE_NAME, char_name_list)
 
 
 window = gui_module.Window(window_size = (1300, 900),
                            title = "電波人間カジノ闘技場統計",
                            )
 
+ui_module.Routine.refresh_requester = window.request_refresh
+
 routine = ui_module.MainRoutine(
                   window.root,
-                  window_object_list,
+                  window_object_registry,
                   display_id_list,
                   forget_id_list,
                   destroy_id_list,
                   char_name_list,
                   record)
 
-window.start_refresh_loop(
-  lambda: refresh(window_object_list,
+# ルーチンは入力があったときだけ実行する
+window.set_refresh_function(
+  lambda: refresh(window_object_registry,
                   display_id_list,
                   forget_id_list,
                   destroy_id_list,
@@ -96,7 +79,12 @@ window.start_refresh_loop(
                   window.root,
                   char_name_list,
                   record),
-  250
   )
+window.request_refresh()
+
+# 閉じるときに戦績をファイルへ書き終えてから終了する
+window.add_close_callback(lambda: stats_module.save_strength_model(record))
+window.add_close_callback(record.compact)
+window.add_close_callback(record.close)
 
 window.canvas.mainloop()
\ No newline at end of file
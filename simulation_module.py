@@ -0,0 +1,256 @@
+# 記録されている勝率とオッズで、賭け方ごとの資金の増減をモンテカルロ法で調べる
+#
+# 1戦ごとに、試合数に比例した確率で対戦カードを選び、
+# その対戦カードの勝率・引き分け率(ベイズ推定の平均)で結果を決める
+# 賭け方(Strategy)ごとに、破産する確率と最終的な資金の倍率の分布を求める
+#
+# 使い方
+# python simulation_module.py --fights 1000 --trajectories 2000
+import argparse
+import math
+import random
+import statistics
+import time
+import data_module
+import stats_module
+from typing import NamedTuple
+
+
+class MatchupModel(NamedTuple):
+  """
+  シミュレーションで使う1つの対戦カード
+  各リストは記録の並び順で、空欄の位置は勝率0・オッズ0
+  """
+  row_index: int
+  weight: int               # 選ばれやすさ(試合数)
+  win_ratio_list: tuple[float, ...]
+  draw_ratio: float
+  odds_list: tuple[float, ...]
+  best_slot: int            # リターン率が最も高い位置
+  best_rtp: float
+
+
+class BetPlan(NamedTuple):
+  """
+  1つの対戦カードでの賭け方
+  掛け金は stake + bankroll_fraction × その時点の資金(資金を超える分は賭けない)
+  """
+  slot: int
+  stake: float
+  bankroll_fraction: float
+
+
+class FlatStrategy:
+  """
+  毎回、リターン率が最も高いキャラに同じ額を賭ける
+  """
+  def __init__(self, stake: float = 1.0):
+    self.name = "定額"
+    self.stake = stake
+
+  def plan(self, matchup: MatchupModel) -> BetPlan:
+    return BetPlan(matchup.best_slot, self.stake, 0.0)
+
+
+class PositiveRTPStrategy:
+  """
+  リターン率が100%を超える対戦カードだけ、同じ額を賭ける
+  """
+  def __init__(self, stake: float = 1.0, threshold: float = 1.0):
+    self.name = "リターン率100%超のみ"
+    self.stake = stake
+    self.threshold = threshold
+
+  def plan(self, matchup: MatchupModel) -> BetPlan:
+    if matchup.best_rtp <= self.threshold:
+      return None
+    return BetPlan(matchup.best_slot, self.stake, 0.0)
+
+
+class KellyStrategy:
+  """
+  ケリー基準の fraction 倍の割合を賭ける(fraction = 0.5 ならハーフケリー)
+  リターン率が100%以下の対戦カードには賭けない
+  """
+  def __init__(self, fraction: float = 0.5):
+    self.name = "ケリー×{}".format(fraction)
+    self.fraction = fraction
+
+  def plan(self, matchup: MatchupModel) -> BetPlan:
+    slot = matchup.best_slot
+    kelly = stats_module.kelly_fraction(matchup.win_ratio_list[slot],
+                                        matchup.draw_ratio,
+                                        matchup.odds_list[slot])
+    if kelly <= 0.0:
+      return None
+    return BetPlan(slot, 0.0, kelly * self.fraction)
+
+
+class SimulationResult(NamedTuple):
+  strategy_name: str
+  trajectory_count: int
+  fight_count: int
+  ruin_probability: float
+  # {パーセント: 最終的な資金 / 最初の資金}
+  growth_percentile_dict: dict[int, float]
+  # 1戦あたりの対数成長率の平均
+  # 破産した試行も、破産した時点の資金で試合数分を見たものとして含める
+  # (資金が0になった試行があれば -inf)
+  mean_log_growth: float
+  elapsed_time: float
+
+
+# 求めるパーセンタイル
+PERCENTILE_LIST = [5, 25, 50, 75, 95]
+
+
+def build_matchup_model_list(record: "data_module.Record", min_total: int = 1,
+                             prior: float = stats_module.PRIOR) -> list[MatchupModel]:
+  """
+  試合数がmin_total以上の対戦カードを MatchupModel にする
+  勝率・引き分け率は stats_module.PosteriorStats と同じ事後平均
+  (試合数が少なくても確率が0や1にならない)
+  """
+  empty_id = record.name_list.EMPTY_ID
+  matchup_model_list = []
+  for i in range(len(record)):
+    total = record.total_column[i]
+    if total < min_total:
+      continue
+    exists_list = [record.id_column_list[slot][i] != empty_id for slot in range(4)]
+    alpha_list = [prior + record.result_column_list[slot][i] if exists_list[slot] else 0.0
+                  for slot in range(4)]
+    alpha_list.append(prior + record.result_column_list[4][i])
+    alpha_sum = sum(alpha_list)
+    win_ratio_list = tuple(alpha / alpha_sum for alpha in alpha_list[0:4])
+    draw_ratio = alpha_list[4] / alpha_sum
+    odds_list = tuple(record.odds_column_list[slot][i] if exists_list[slot] else 0.0
+                      for slot in range(4))
+
+    rtp_list = [stats_module.rtp(win_ratio_list[slot], draw_ratio, odds_list[slot])
+                if exists_list[slot] else 0.0
+                for slot in range(4)]
+    best_slot = max(range(4), key = lambda slot: rtp_list[slot])
+    matchup_model_list.append(MatchupModel(i, total, win_ratio_list, draw_ratio, odds_list,
+                                           best_slot, rtp_list[best_slot]))
+  return matchup_model_list
+
+
+def simulate(
+    matchup_model_list: list[MatchupModel],
+    strategy,
+    fight_count: int = 1000,
+    trajectory_count: int = 1000,
+    initial_bankroll: float = 100.0,
+    ruin_bankroll: float = 1.0,
+    seed: int = None,
+    ) -> SimulationResult:
+  """
+  strategyは plan(matchup: MatchupModel) -> BetPlan を持つもの(賭けない場合はNoneを返す)
+  資金がruin_bankroll未満になったら破産とし、その試行は打ち切る
+  """
+  start_time = time.perf_counter()
+  generator = random.Random(seed)
+
+  # 対戦カードごとに、賭け方と結果の境目を先に求めておく
+  # (勝ち: u < win_limit, 引き分け: u < draw_limit, それ以外は負け)
+  plan_list = []
+  for matchup in matchup_model_list:
+    bet_plan = strategy.plan(matchup)
+    if bet_plan == None:
+      plan_list.append(None)
+      continue
+    win_limit = matchup.win_ratio_list[bet_plan.slot]
+    plan_list.append((bet_plan.stake,
+                      bet_plan.bankroll_fraction,
+                      win_limit,
+                      win_limit + matchup.draw_ratio,
+                      matchup.odds_list[bet_plan.slot] - 1.0))
+
+  cum_weight_list = []
+  weight_sum = 0
+  for matchup in matchup_model_list:
+    weight_sum += matchup.weight
+    cum_weight_list.append(weight_sum)
+
+  ruin_count = 0
+  growth_list = []
+  log_growth_list = []
+  uniform = generator.random
+  for trajectory in range(trajectory_count):
+    bankroll = initial_bankroll
+    ruined = False
+    # 対戦カードは試行ごとにまとめて選ぶ
+    index_list = generator.choices(range(len(plan_list)), cum_weights = cum_weight_list, k = fight_count)
+    for index in index_list:
+      bet = plan_list[index]
+      if bet == None:
+        continue
+      stake = bet[0] + bet[1] * bankroll
+      if stake > bankroll:
+        stake = bankroll
+      u = uniform()
+      if u < bet[2]:
+        bankroll += stake * bet[4]
+      elif u >= bet[3]:
+        bankroll -= stake
+        if bankroll < ruin_bankroll:
+          ruined = True
+          break
+
+    growth_list.append(bankroll / initial_bankroll)
+    if ruined:
+      ruin_count += 1
+    if bankroll > 0.0:
+      log_growth_list.append(math.log(bankroll / initial_bankroll) / fight_count)
+    else:
+      log_growth_list.append(-math.inf)
+
+  if len(growth_list) >= 2:
+    quantile_list = statistics.quantiles(growth_list, n = 100, method = "inclusive")
+    growth_percentile_dict = {percent: quantile_list[percent - 1] for percent in PERCENTILE_LIST}
+  else:
+    growth_percentile_dict = {percent: growth_list[0] if len(growth_list) == 1 else 0.0
+                              for percent in PERCENTILE_LIST}
+
+  return SimulationResult(strategy.name,
+                          trajectory_count,
+                          fight_count,
+                          stats_module.ratio(ruin_count, trajectory_count),
+                          growth_percentile_dict,
+                          statistics.fmean(log_growth_list) if len(log_growth_list) != 0 else 0.0,
+                          time.perf_counter() - start_time)
+
+
+def main():
+  parser = argparse.ArgumentParser(description = "賭け方ごとの資金の増減をシミュレーションする")
+  parser.add_argument("-r", "--record", default = "record.csv", help = "戦績ファイル")
+  parser.add_argument("-c", "--char", default = "char_name.csv", help = "キャラ一覧")
+  parser.add_argument("--fights", type = int, default = 1000, help = "1回の試行で見る試合数")
+  parser.add_argument("--trajectories", type = int, default = 1000, help = "試行回数")
+  parser.add_argument("--bankroll", type = float, default = 100.0, help = "最初の資金")
+  parser.add_argument("--min-total", type = int, default = 1, help = "使う対戦カードの最低試合数")
+  parser.add_argument("--seed", type = int, default = None)
+  args = parser.parse_args()
+
+  record = data_module.Record(args.record, data_module.NameList(args.char))
+  matchup_model_list = build_matchup_model_list(record, args.min_total)
+  record.close()
+  if len(matchup_model_list) == 0:
+    print("対戦カードがありません")
+    return
+
+  for strategy in (FlatStrategy(), PositiveRTPStrategy(), KellyStrategy(1.0), KellyStrategy(0.5)):
+    result = simulate(matchup_model_list, strategy, args.fights, args.trajectories,
+                      args.bankroll, seed = args.seed)
+    print("{}: 破産確率 {:.2f}%  資金の倍率 {}  対数成長率/戦 {:+.5f}  ({:.0f}戦/秒)".format(
+      result.strategy_name,
+      result.ruin_probability * 100,
+      "  ".join("{}%:{:.3g}".format(percent, growth)
+                for percent, growth in result.growth_percentile_dict.items()),
+      result.mean_log_growth,
+      result.fight_count * result.trajectory_count / max(result.elapsed_time, 1e-9)))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,385 @@
+import os
+import sqlite3
+import time
+import data_module
+import stats_module
+
+
+class SQLiteNameList(data_module.NameList):
+  """
+  SQLiteのデータベースに保存するキャラ名の一覧
+  使い方は data_module.NameList と同じ
+  char_name.csvに載っていたキャラは listed = 1 で、idはchar_name.csvの行番号のまま
+  一覧にないキャラは追加した順にその後ろのidになる
+  """
+  def __init__(self, file_name: str):
+    self.connection = connect(file_name)
+    self.name_list = []
+    self.id_dict = {}
+    self.data = []
+    for char_id, name, listed in self.connection.execute(
+        "SELECT id, name, listed FROM character ORDER BY id"):
+      self.name_list.append(name)
+      self.id_dict.setdefault(name, char_id)
+      if listed:
+        self.data.append([name])
+
+
+  def to_id(self, name: str) -> int:
+    """
+    キャラ名をidに変換する
+    一覧にないキャラは新しくidを割り当て、データベースにも追加する
+    """
+    if name == "":
+      return self.EMPTY_ID
+    char_id = self.id_dict.get(name)
+    if char_id == None:
+      char_id = super().to_id(name)
+      self.connection.execute("INSERT INTO character(id, name, listed) VALUES (?, ?, 0)",
+                              (char_id, name))
+      self.connection.commit()
+    return char_id
+
+
+class SQLiteRecord(data_module.Record):
+  """
+  SQLiteのデータベースに保存する戦績データ
+  使い方は data_module.Record と同じで、画面側はどちらを使っているかを気にしなくてよい
+
+  matchupテーブルの1行が Record の1行に対応し、idが行番号になる
+  メモリ上には列だけを持ち、索引やキャラごとの集計はメモリ上に作らずにデータベースに問い合わせる
+  対戦カードの検索はキャラidを並べ替えた key0~key3 の索引で、
+  (record.csvと同じく、同じ対戦カードが複数行あれば最初の行を使う)
+  キャラを含む対戦カードと候補キャラの検索はキャラごとの matchup_character テーブルで、
+  キャラごとの集計は query_character_stats() で行う
+  変わった行はその場で1行ずつupsertし、WALモードなので待ち時間はほとんどない
+  """
+  FILE_EXTENSION = ".db"
+
+  _UPSERT_MATCHUP = """
+    INSERT INTO matchup(id, key0, key1, key2, key3, char0, char1, char2, char3,
+                        total, win0, win1, win2, win3, draw, odds0, odds1, odds2, odds3)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+      total = excluded.total,
+      win0 = excluded.win0, win1 = excluded.win1, win2 = excluded.win2, win3 = excluded.win3,
+      draw = excluded.draw,
+      odds0 = excluded.odds0, odds1 = excluded.odds1, odds2 = excluded.odds2, odds3 = excluded.odds3
+    """
+  _INSERT_MATCHUP_CHARACTER = """
+    INSERT OR IGNORE INTO matchup_character(character_id, matchup_id, slot) VALUES (?, ?, ?)
+    """
+
+  def __init__(self, file_name: str, name_list: SQLiteNameList, backup_count: int = data_module.Record.BACKUP_COUNT):
+    # ジャーナルもRecordWriterも使わないので Record.__init__ は呼ばない
+    self.file_name = file_name
+    self.name_list = name_list
+    self.backup_count = backup_count
+    self.connection = name_list.connection
+    self.version = 0
+    self.listener_list = []
+    self.strength_model = None
+    # query_character_stats() の結果と、そのときの version
+    self._character_stats_cache = None
+    self._character_stats_version = None
+    self.odds_history = data_module.OddsHistory(os.path.splitext(file_name)[0] + "_odds.dat")
+
+    self.reload()
+
+
+  @classmethod
+  def is_database_file_name(cls, file_name: str) -> bool:
+    return os.path.splitext(file_name)[1] == cls.FILE_EXTENSION
+
+
+  def reload(self):
+    """
+    データベースから読み直す
+    """
+    self._init_columns()
+    for row in self.connection.execute(
+        """
+        SELECT char0, char1, char2, char3, total, win0, win1, win2, win3, draw,
+               odds0, odds1, odds2, odds3
+        FROM matchup ORDER BY id
+        """):
+      self._append_row(list(row[0:4]), row[4], list(row[5:10]), list(row[10:14]))
+
+    for listener in self.listener_list:
+      listener.on_reload()
+
+
+  def row_index_set(self, char_id: int) -> set[int]:
+    """
+    char_idのキャラが含まれる行番号の集合
+    """
+    return {row_index for (row_index,) in self.connection.execute(
+      "SELECT DISTINCT matchup_id FROM matchup_character WHERE character_id = ?",
+      (char_id,))}
+
+
+  def suggestions(self, id_list: list[int]) -> set[int]:
+    """
+    id_list全員を含む対戦カードに登場する、id_list以外のキャラidの集合
+    """
+    char_id_list = sorted(set(id_list))
+    if len(char_id_list) == 0:
+      return set()
+    placeholder = ", ".join("?" * len(char_id_list))
+    suggestion_set = {char_id for (char_id,) in self.connection.execute(
+      """
+      SELECT DISTINCT character_id FROM matchup_character
+      WHERE matchup_id IN (
+        SELECT matchup_id FROM matchup_character
+        WHERE character_id IN ({0})
+        GROUP BY matchup_id
+        HAVING COUNT(DISTINCT character_id) = ?
+        )
+      AND character_id NOT IN ({0})
+      """.format(placeholder),
+      (*char_id_list, len(char_id_list), *char_id_list))}
+    return suggestion_set
+
+
+  @property
+  def character_stats_dict(self) -> dict[int, stats_module.CharacterStats]:
+    """
+    キャラごとの集計 {キャラid: stats_module.CharacterStats}
+    データベース側で集計し、データが変わるまでは前回の結果を使い回す
+    """
+    if self._character_stats_version != self.version:
+      self._character_stats_cache = self.query_character_stats()
+      self._character_stats_version = self.version
+    return self._character_stats_cache
+
+
+  def query_character_stats(self) -> dict[int, stats_module.CharacterStats]:
+    """
+    全キャラの統計を {キャラid: CharacterStats} で返す
+    stats_module.all_character_stats() と同じ集計をデータベース側で行う
+    """
+    character_stats_dict = {}
+    for char_id, appearances, wins, draws, odds_sum, return_sum in self.connection.execute(
+        """
+        SELECT character_id,
+               SUM(total),
+               SUM(win),
+               SUM(draw),
+               SUM(total * odds),
+               SUM(win * odds + draw)
+        FROM (
+          SELECT mc.character_id AS character_id, m.total AS total, m.draw AS draw,
+                 CASE mc.slot WHEN 0 THEN m.win0 WHEN 1 THEN m.win1
+                              WHEN 2 THEN m.win2 ELSE m.win3 END AS win,
+                 CASE mc.slot WHEN 0 THEN m.odds0 WHEN 1 THEN m.odds1
+                              WHEN 2 THEN m.odds2 ELSE m.odds3 END AS odds
+          FROM matchup_character AS mc
+          JOIN matchup AS m ON m.id = mc.matchup_id
+          )
+        GROUP BY character_id
+        """):
+      character_stats = stats_module.CharacterStats()
+      character_stats.appearances = appearances
+      character_stats.wins = wins
+      character_stats.draws = draws
+      character_stats.odds_sum = odds_sum
+      character_stats.return_sum = return_sum
+      character_stats_dict[char_id] = character_stats
+    return character_stats_dict
+
+
+  def write(self):
+    """
+    全データをデータベースに書き直す
+    """
+    with self.connection:
+      self.connection.execute("DELETE FROM matchup_character")
+      self.connection.execute("DELETE FROM matchup")
+      for i in range(len(self)):
+        self._write_row(i)
+
+
+  def backup(self, keep: bool = False):
+    """
+    データベースを1世代ずつずらしてバックアップする
+    keepがTrueなら、世代をずらさずに日時を付けた名前で残す
+    """
+    self.compact()
+    if keep:
+      data_module.timestamp_backup([self.file_name])
+    else:
+      data_module.rotate_backup(self.file_name, self.backup_count)
+
+
+  def flush(self):
+    self.connection.commit()
+
+
+  def close(self):
+    self.odds_history.close_append()
+    self.connection.close()
+
+
+  def save_as(self, file_name: str):
+    """
+    全データを Record と同じ形式のファイルに書き出す
+    拡張子が .bin ならバイナリ形式、それ以外はrecord.csvと同じ形式
+    """
+    data_module.write_snapshot_file(file_name, self.name_list.name_list, self._column_list())
+
+
+  def compact(self):
+    """
+    WALの内容をデータベース本体に反映する
+    """
+    self.connection.commit()
+    self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+  def commit_fight(self, id_list: list[int], result: int, odds: list[float]):
+    """
+    1戦分の結果を反映し、その行だけをデータベースに書き込む
+    オッズの履歴は Record と同じファイルに追記する
+    引数は data_module.Record.commit_fight() と同じ
+    """
+    with self.connection:
+      self._apply_fight(id_list, result, odds)
+    names = [self.name_list.to_name(char_id) for char_id in id_list]
+    with self.odds_history.open_append() as f:
+      f.write(self.odds_history.add(names, odds, result, time.time()))
+
+    for listener in self.listener_list:
+      listener.on_fight(id_list, result)
+
+
+  def merge(self, fight_log_iter) -> int:
+    """
+    別の記録を足し合わせる(data_module.Record.merge()を参照)
+    変わった行だけを1つのトランザクションで書き込む
+    """
+    count = 0
+    with self.connection:
+      for fight_log in fight_log_iter:
+        self._merge_row([self.name_list.to_id(name) for name in fight_log.names],
+                        fight_log.total,
+                        fight_log.result_list,
+                        fight_log.odds_list)
+        count += 1
+
+    for listener in self.listener_list:
+      listener.on_reload()
+    return count
+
+
+  def _merge_row(self, id_list: list[int], total: int, result_list: list[int], odds_list: list[float]) -> int:
+    # 次の行の検索でも見つかるよう、すぐにデータベースへ書き込む(コミットは呼び出し側で行う)
+    row_index = super()._merge_row(id_list, total, result_list, odds_list)
+    self._write_row(row_index)
+    return row_index
+
+
+  def _find_key(self, key: tuple[int]) -> int:
+    found = self.connection.execute(
+      """
+      SELECT id FROM matchup WHERE key0 = ? AND key1 = ? AND key2 = ? AND key3 = ?
+      ORDER BY id LIMIT 1
+      """,
+      key).fetchone()
+    if found == None:
+      return None
+    return found[0]
+
+
+  def _write_row(self, row_index: int):
+    id_list = self.row_id_list(row_index)
+    self.connection.execute(
+      self._UPSERT_MATCHUP,
+      (row_index,
+       *self.make_key(id_list),
+       *id_list,
+       self.total_column[row_index],
+       *(self.result_column_list[i][row_index] for i in range(5)),
+       *(self.odds_column_list[i][row_index] for i in range(4))))
+    self.connection.executemany(
+      self._INSERT_MATCHUP_CHARACTER,
+      ((id_list[i], row_index, i) for i in range(4) if id_list[i] != data_module.NameList.EMPTY_ID))
+
+
+def connect(file_name: str) -> sqlite3.Connection:
+  """
+  データベースを開き、なければテーブルを作る
+  """
+  connection = sqlite3.connect(file_name)
+  connection.execute("PRAGMA journal_mode = WAL")
+  # WALモードではコミットごとのfsyncを省いても壊れない(直前の数戦が消えることはある)
+  connection.execute("PRAGMA synchronous = NORMAL")
+  with connection:
+    connection.executescript(
+      """
+      CREATE TABLE IF NOT EXISTS character(
+        id      INTEGER PRIMARY KEY,
+        name    TEXT NOT NULL,
+        listed  INTEGER NOT NULL
+        );
+      CREATE TABLE IF NOT EXISTS matchup(
+        id      INTEGER PRIMARY KEY,
+        key0    INTEGER NOT NULL,
+        key1    INTEGER NOT NULL,
+        key2    INTEGER NOT NULL,
+        key3    INTEGER NOT NULL,
+        char0   INTEGER NOT NULL,
+        char1   INTEGER NOT NULL,
+        char2   INTEGER NOT NULL,
+        char3   INTEGER NOT NULL,
+        total   INTEGER NOT NULL,
+        win0    INTEGER NOT NULL,
+        win1    INTEGER NOT NULL,
+        win2    INTEGER NOT NULL,
+        win3    INTEGER NOT NULL,
+        draw    INTEGER NOT NULL,
+        odds0   REAL NOT NULL,
+        odds1   REAL NOT NULL,
+        odds2   REAL NOT NULL,
+        odds3   REAL NOT NULL
+        );
+      CREATE INDEX IF NOT EXISTS matchup_key ON matchup(key0, key1, key2, key3);
+      CREATE TABLE IF NOT EXISTS matchup_character(
+        character_id  INTEGER NOT NULL,
+        matchup_id    INTEGER NOT NULL,
+        slot          INTEGER NOT NULL,
+        PRIMARY KEY (character_id, matchup_id, slot)
+        ) WITHOUT ROWID;
+      CREATE INDEX IF NOT EXISTS matchup_character_matchup ON matchup_character(matchup_id);
+      """)
+  return connection
+
+
+def migrate(record_file_name: str, char_file_name: str, database_file_name: str):
+  """
+  record.csv(または .bin)とchar_name.csvの内容でデータベースを作る
+  ジャーナルに残っている分も含めて移す
+  """
+  if os.path.exists(database_file_name):
+    raise FileExistsError(database_file_name)
+
+  name_list = data_module.NameList(char_file_name)
+  record = data_module.Record(record_file_name, name_list)
+  record.close()
+
+  connection = connect(database_file_name)
+  with connection:
+    connection.executemany(
+      "INSERT INTO character(id, name, listed) VALUES (?, ?, ?)",
+      ((char_id, name_list.name_list[char_id], int(name_list.is_listed(char_id)))
+       for char_id in range(len(name_list.name_list))))
+  connection.close()
+
+  sqlite_record = SQLiteRecord(database_file_name, SQLiteNameList(database_file_name))
+  for i in range(len(record)):
+    sqlite_record._append_row(record.row_id_list(i),
+                              record.total_column[i],
+                              [record.result_column_list[j][i] for j in range(5)],
+                              [record.odds_column_list[j][i] for j in range(4)])
+  sqlite_record.write()
+  sqlite_record.compact()
+  sqlite_record.close()
@@ -0,0 +1,543 @@
+"""
+戦績の統計計算
+tkinterには依存しないので、画面なしでも使用できる
+
+リターン率は、引き分けの場合は掛け金がそのまま戻ってくるため
+リターン率 = 勝率 × オッズ + 引き分け率
+で算出する
+
+python stats_module.py で、リターン率の高い賭け方の一覧を表示する(main()を参照)
+"""
+import argparse
+import array
+import csv
+import heapq
+import math
+import os
+import statistics
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+  import data_module
+
+
+# ベイズ推定で使うディリクレ事前分布のパラメータ(各結果に同じ値を置く)
+PRIOR = 1.0
+# 信用区間の幅
+CREDIBLE_LEVEL = 0.95
+
+
+def ratio(count: int, total: int) -> float:
+  """
+  試合数が0の場合は0を返す
+  """
+  if total == 0:
+    return 0.0
+  return count / total
+
+
+def rtp(win_ratio: float, draw_ratio: float, odds: float) -> float:
+  return win_ratio * odds + draw_ratio
+
+
+def kelly_fraction(win_ratio: float, draw_ratio: float, odds: float) -> float:
+  """
+  資金のうち賭けるべき割合(ケリー基準)
+  引き分けは掛け金が戻ってくるので、負ける確率 q = 1 - 勝率 - 引き分け率 として
+  f = (p(o-1) - q) / ((o-1)(p+q))
+  リターン率が1以下なら0になる
+  """
+  lose_ratio = 1.0 - win_ratio - draw_ratio
+  if odds <= 1.0 or win_ratio <= 0.0:
+    return 0.0
+  fraction = (win_ratio * (odds - 1.0) - lose_ratio) / ((odds - 1.0) * (win_ratio + lose_ratio))
+  return min(max(fraction, 0.0), 1.0)
+
+
+def sort_slot_list(id_list: list[int]) -> list[int]:
+  """
+  id_listをchar_name.csvの順(空欄は最後)に並べたとき、各キャラが何番目に来るかを返す
+  同じidが複数ある場合は元の順番を保つ
+  """
+  sorted_index_list = sorted(range(len(id_list)), key = lambda i: id_list[i])
+  slot_list = [0] * len(id_list)
+  for i in range(len(id_list)):
+    slot_list[sorted_index_list[i]] = i
+  return slot_list
+
+
+
+def beta_cdf(x: float, a: float, b: float) -> float:
+  """
+  ベータ分布の累積分布関数(正則化不完全ベータ関数)
+  連分数展開で計算する
+  """
+  if x <= 0.0:
+    return 0.0
+  if x >= 1.0:
+    return 1.0
+  log_front = (math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b)
+               + a * math.log(x) + b * math.log(1.0 - x))
+  if x < (a + 1.0) / (a + b + 2.0):
+    return math.exp(log_front) * _beta_continued_fraction(x, a, b) / a
+  else:
+    return 1.0 - math.exp(log_front) * _beta_continued_fraction(1.0 - x, b, a) / b
+
+
+def _beta_continued_fraction(x: float, a: float, b: float) -> float:
+  tiny = 1e-300
+  c = 1.0
+  d = 1.0 - (a + b) * x / (a + 1.0)
+  d = 1.0 / (d if abs(d) > tiny else tiny)
+  h = d
+  for m in range(1, 201):
+    for numerator in (m * (b - m) * x / ((a + 2*m - 1.0) * (a + 2*m)),
+                      -(a + m) * (a + b + m) * x / ((a + 2*m) * (a + 2*m + 1.0))):
+      d = 1.0 + numerator * d
+      d = 1.0 / (d if abs(d) > tiny else tiny)
+      c = 1.0 + numerator / c
+      c = c if abs(c) > tiny else tiny
+      h *= d * c
+    if abs(d * c - 1.0) < 1e-14:
+      break
+  return h
+
+
+def beta_ppf(q: float, a: float, b: float) -> float:
+  """
+  ベータ分布の分位点
+  """
+  low, high = 0.0, 1.0
+  for i in range(50):
+    middle = (low + high) / 2
+    if beta_cdf(middle, a, b) < q:
+      low = middle
+    else:
+      high = middle
+  return (low + high) / 2
+
+
+def beta_interval(a: float, b: float, level: float = CREDIBLE_LEVEL) -> tuple[float, float]:
+  """
+  ベータ分布の中央の信用区間
+  """
+  return (beta_ppf((1.0 - level) / 2, a, b), beta_ppf((1.0 + level) / 2, a, b))
+
+
+
+class MatchupStats:
+  """
+  1つの対戦カードの統計
+  各リストは記録の並び順
+  """
+  def __init__(
+      self,
+      total: int,
+      win_list: list[int],
+      draw: int,
+      odds_list: list[float],
+      ):
+    self.total = total
+    self.win_ratio_list = [ratio(win, total) for win in win_list]
+    self.draw_ratio = ratio(draw, total)
+    # 記録されている最後のオッズでのリターン率
+    self.rtp_list = [rtp(self.win_ratio_list[i], self.draw_ratio, odds_list[i])
+                     for i in range(4)]
+
+
+  def rtp_at(self, slot: int, odds: float) -> float:
+    """
+    任意のオッズでのリターン率
+    """
+    return rtp(self.win_ratio_list[slot], self.draw_ratio, odds)
+
+
+
+class PosteriorStats:
+  """
+  1つの対戦カードの勝率・引き分け率のベイズ推定
+  各キャラの勝ちと引き分けの確率にディリクレ事前分布を置き、
+  事後分布の平均と信用区間を求める
+  試合数が少ないほど区間は広くなる
+  各リストは記録の並び順で、空欄の位置は0になる
+  """
+  def __init__(
+      self,
+      win_list: list[int],
+      draw: int,
+      exists_list: list[bool],
+      prior: float = PRIOR,
+      level: float = CREDIBLE_LEVEL,
+      ):
+    self.level = level
+    self.alpha_list = [prior + win_list[i] if exists_list[i] else 0.0
+                       for i in range(4)]
+    self.alpha_list.append(prior + draw)
+    self.alpha_sum = sum(self.alpha_list)
+
+    # 各結果の周辺分布はベータ分布 Beta(alpha, alpha_sum - alpha)
+    self.mean_list = [alpha / self.alpha_sum for alpha in self.alpha_list]
+    self.interval_list = [beta_interval(alpha, self.alpha_sum - alpha, level)
+                          if alpha > 0 else (0.0, 0.0)
+                          for alpha in self.alpha_list]
+
+  @property
+  def win_mean_list(self) -> list[float]:
+    return self.mean_list[0:4]
+
+  @property
+  def draw_mean(self) -> float:
+    return self.mean_list[4]
+
+  def rtp_mean(self, slot: int, odds: float) -> float:
+    return rtp(self.mean_list[slot], self.mean_list[4], odds)
+
+  def rtp_interval(self, slot: int, odds: float) -> tuple[float, float]:
+    """
+    リターン率の信用区間
+    リターン率は勝率と引き分け率の1次式なので、平均と分散は閉じた式で求まる
+    区間はそれを正規分布で近似したもの
+    """
+    weight_list = [0.0] * 5
+    weight_list[slot] = odds
+    weight_list[4] += 1.0
+    mean = sum(weight_list[i] * self.mean_list[i] for i in range(5))
+    square_mean = sum(weight_list[i] ** 2 * self.mean_list[i] for i in range(5))
+    sd = math.sqrt(max(square_mean - mean ** 2, 0.0) / (self.alpha_sum + 1))
+    z = statistics.NormalDist().inv_cdf(0.5 + self.level / 2)
+    return (max(mean - z * sd, 0.0), mean + z * sd)
+
+
+
+class CharacterStats:
+  """
+  1体のキャラの全対戦カードを通した統計
+  """
+  def __init__(self):
+    self.appearances = 0
+    self.wins = 0
+    self.draws = 0
+    # オッズの合計
+    self.odds_sum = 0.0
+    # 毎回1ずつ賭けた場合に戻ってきた額の合計
+    self.return_sum = 0.0
+
+  def add(self, total: int, win: int, draw: int, odds: float):
+    """
+    total試合分を加える(その間のオッズは全てoddsとみなす)
+    """
+    self.appearances += total
+    self.wins += win
+    self.draws += draw
+    self.odds_sum += total * odds
+    self.return_sum += win * odds + draw
+
+  @property
+  def win_ratio(self) -> float:
+    return ratio(self.wins, self.appearances)
+
+  @property
+  def draw_ratio(self) -> float:
+    return ratio(self.draws, self.appearances)
+
+  @property
+  def mean_odds(self) -> float:
+    if self.appearances == 0:
+      return 0.0
+    return self.odds_sum / self.appearances
+
+  @property
+  def rtp(self) -> float:
+    if self.appearances == 0:
+      return 0.0
+    return self.return_sum / self.appearances
+
+
+
+def matchup_stats(record: "data_module.Record", row_index: int) -> MatchupStats:
+  return MatchupStats(record.total_column[row_index],
+                      [record.result_column_list[i][row_index] for i in range(4)],
+                      record.result_column_list[4][row_index],
+                      [record.odds_column_list[i][row_index] for i in range(4)])
+
+
+def posterior_stats(record: "data_module.Record", row_index: int) -> PosteriorStats:
+  empty_id = record.name_list.EMPTY_ID
+  return PosteriorStats([record.result_column_list[i][row_index] for i in range(4)],
+                        record.result_column_list[4][row_index],
+                        [record.id_column_list[i][row_index] != empty_id for i in range(4)])
+
+
+def all_matchup_stats(record: "data_module.Record") -> list[MatchupStats]:
+  """
+  全対戦カードの統計を行番号順に返す
+  """
+  return [matchup_stats(record, i) for i in range(len(record))]
+
+
+def all_character_stats(record: "data_module.Record") -> dict[int, CharacterStats]:
+  """
+  全キャラの統計を {キャラid: CharacterStats} で返す
+  記録されているオッズは最後の1戦のものなので、return_sumはそのオッズで計算した値
+  全行を集計し直すので、普段は record.character_stats_dict を使うこと
+  """
+  empty_id = record.name_list.EMPTY_ID
+  character_stats_dict = {}
+  draw_column = record.result_column_list[4]
+  for slot in range(4):
+    id_column = record.id_column_list[slot]
+    win_column = record.result_column_list[slot]
+    odds_column = record.odds_column_list[slot]
+    for i in range(len(record)):
+      char_id = id_column[i]
+      if char_id == empty_id:
+        continue
+      character_stats = character_stats_dict.get(char_id)
+      if character_stats == None:
+        character_stats = CharacterStats()
+        character_stats_dict[char_id] = character_stats
+      character_stats.add(record.total_column[i], win_column[i], draw_column[i], odds_column[i])
+  return character_stats_dict
+
+
+def all_rtp_column_list(record: "data_module.Record") -> list[array.array]:
+  """
+  全対戦カードのリターン率を、記録されているオッズで計算する
+  行ごとに RecordRow を作らず、位置ごとに列をzipでたどって1本のarrayにする
+  戻り値[位置][行番号] で参照する
+  空欄の位置は0になる
+  """
+  empty_id = record.name_list.EMPTY_ID
+  total_column = record.total_column
+  draw_column = record.result_column_list[4]
+  draw_ratio_column = array.array('d', (ratio(draw, total)
+                                        for draw, total in zip(draw_column, total_column)))
+  rtp_column_list = []
+  for slot in range(4):
+    rtp_column_list.append(array.array('d', (
+      0.0 if char_id == empty_id else ratio(win, total) * odds + draw_ratio
+      for char_id, win, total, odds, draw_ratio in zip(record.id_column_list[slot],
+                                                       record.result_column_list[slot],
+                                                       total_column,
+                                                       record.odds_column_list[slot],
+                                                       draw_ratio_column)
+      )))
+  return rtp_column_list
+
+
+def best_bets(
+    record: "data_module.Record",
+    count: int = 10,
+    min_total: int = 1,
+    ) -> list[tuple[float, int, int]]:
+  """
+  リターン率が100%を超える賭け方を高い順にcount個返す [(リターン率, 行番号, 位置)]
+  試合数がmin_total未満の対戦カードは除く
+  """
+  total_column = record.total_column
+  candidate_iter = (
+    (bet_rtp, i, slot)
+    for slot, rtp_column in enumerate(all_rtp_column_list(record))
+    for i, (bet_rtp, total) in enumerate(zip(rtp_column, total_column))
+    if bet_rtp > 1.0 and total >= min_total
+    )
+  return heapq.nlargest(count, candidate_iter)
+
+
+
+class StrengthModel:
+  """
+  キャラごとの強さを全対戦カードの記録から推定するモデル
+  Plackett-Luceモデル(1位のみ)で、引き分けも仮想的な参加者として扱う
+  P(キャラkが勝つ) = strength[k] / (出場キャラのstrengthの合計 + draw_strength)
+  一度も記録がない組み合わせでも勝率を予想できる
+
+  最初は全データから推定し、その後は1戦ごとに少しずつ更新する
+  推定した強さは save() でファイルに残しておき、次に作るときはその値から反復を始める
+  (全データからの推定が数回の反復で済む)
+  """
+  # 全データから推定するときの反復回数の上限
+  FIT_ITERATIONS = 50
+  # 1回の反復での強さの変化(比)がこれより小さくなったら反復をやめる
+  FIT_TOLERANCE = 1e-4
+  # 1戦ごとの更新の大きさ
+  LEARNING_RATE = 0.1
+
+  def __init__(self, record: "data_module.Record", file_name: str = None):
+    """
+    file_nameは推定した強さを残しておくファイル(Noneなら残さない)
+    """
+    self.record = record
+    self.file_name = file_name
+    self.strength_dict = {}
+    self.draw_strength = 1.0
+    if file_name != None and os.path.exists(file_name):
+      self._load(file_name)
+    self.fit()
+    record.add_listener(self)
+
+
+  def fit(self, iterations: int = FIT_ITERATIONS, tolerance: float = FIT_TOLERANCE):
+    """
+    全データから推定し直す(MMアルゴリズム)
+    強さには Gamma(2, 1) の事前分布を置くので、記録が少ないキャラは1に近づく
+    前回の推定値から反復を始め、変化がtolerance未満になるか、iterations回反復したら終わる
+    """
+    empty_id = self.record.name_list.EMPTY_ID
+    row_list = []
+    win_dict = {}
+    draw_win = 0
+    for i in range(len(self.record)):
+      id_list = []
+      for slot in range(4):
+        char_id = self.record.id_column_list[slot][i]
+        if char_id != empty_id:
+          id_list.append(char_id)
+          win_dict[char_id] = win_dict.get(char_id, 0) + self.record.result_column_list[slot][i]
+      row_list.append((id_list, self.record.total_column[i]))
+      draw_win += self.record.result_column_list[4][i]
+
+    strength_dict = {char_id: self.strength_dict.get(char_id, 1.0) for char_id in win_dict}
+    draw_strength = self.draw_strength
+    for iteration in range(iterations):
+      denominator_dict = dict.fromkeys(strength_dict, 0.0)
+      draw_denominator = 0.0
+      for id_list, total in row_list:
+        weight = total / (sum(strength_dict[char_id] for char_id in id_list) + draw_strength)
+        for char_id in id_list:
+          denominator_dict[char_id] += weight
+        draw_denominator += weight
+      change = 0.0
+      for char_id in strength_dict:
+        strength = (win_dict[char_id] + 1) / (denominator_dict[char_id] + 1)
+        change = max(change, abs(strength - strength_dict[char_id]) / strength_dict[char_id])
+        strength_dict[char_id] = strength
+      strength = (draw_win + 1) / (draw_denominator + 1)
+      change = max(change, abs(strength - draw_strength) / draw_strength)
+      draw_strength = strength
+      if change < tolerance:
+        break
+
+    self.strength_dict = strength_dict
+    self.draw_strength = draw_strength
+
+
+  def save(self):
+    """
+    推定した強さをファイルに書き出す
+    1行目は ["", 引き分けの強さ]、2行目以降は [キャラ名, 強さ]
+    なくなっても推定し直せば済むので、fsyncはしない
+    """
+    if self.file_name == None:
+      return
+    temp_file_name = self.file_name + ".tmp"
+    with open(temp_file_name, 'w', encoding="utf-8", newline="") as f:
+      writer = csv.writer(f)
+      writer.writerow(["", self.draw_strength])
+      writer.writerows([self.record.name_list.to_name(char_id), strength]
+                       for char_id, strength in self.strength_dict.items())
+    os.replace(temp_file_name, self.file_name)
+
+
+  def _load(self, file_name: str):
+    # キャラ名は一覧にあるものだけを使う(読むだけでidを増やさない)
+    id_dict = self.record.name_list.id_dict
+    with open(file_name, encoding="utf-8") as f:
+      for row in csv.reader(f):
+        if len(row) != 2:
+          continue
+        try:
+          strength = float(row[1])
+        except ValueError:
+          continue
+        if strength <= 0.0:
+          continue
+        if row[0] == "":
+          self.draw_strength = strength
+        elif row[0] in id_dict:
+          self.strength_dict[id_dict[row[0]]] = strength
+
+
+  def predict(self, id_list: list[int]) -> list[float]:
+    """
+    各キャラの勝率と引き分け率を id_list の並び + 引き分け の5つで返す
+    空欄の位置は0になる
+    """
+    empty_id = self.record.name_list.EMPTY_ID
+    strength_list = [0.0 if char_id == empty_id else self.strength_dict.get(char_id, 1.0)
+                     for char_id in id_list]
+    strength_list.append(self.draw_strength)
+    strength_sum = sum(strength_list)
+    return [strength / strength_sum for strength in strength_list]
+
+
+  def on_fight(self, id_list: list[int], result: int):
+    """
+    1戦分だけ対数尤度の勾配方向に更新する
+    """
+    probability_list = self.predict(id_list)
+    empty_id = self.record.name_list.EMPTY_ID
+    for slot in range(4):
+      char_id = id_list[slot]
+      if char_id == empty_id:
+        continue
+      gradient = (1.0 if slot == result else 0.0) - probability_list[slot]
+      self.strength_dict[char_id] = (self.strength_dict.get(char_id, 1.0)
+                                     * math.exp(self.LEARNING_RATE * gradient))
+    gradient = (1.0 if result == 4 else 0.0) - probability_list[4]
+    self.draw_strength *= math.exp(self.LEARNING_RATE * gradient)
+
+
+  def on_reload(self):
+    self.fit()
+
+
+
+def strength_model(record: "data_module.Record") -> StrengthModel:
+  """
+  recordに対応するStrengthModelを返す
+  初回だけ全データから推定し、以降は同じもの(record.strength_model)を使い回す
+  推定した強さは record_strength.csv のようにrecordのファイル名に合わせた名前で残す
+  """
+  if record.strength_model == None:
+    record.strength_model = StrengthModel(
+      record, os.path.splitext(record.file_name)[0] + "_strength.csv")
+  return record.strength_model
+
+
+def save_strength_model(record: "data_module.Record"):
+  """
+  recordのStrengthModelを作っていれば、推定した強さをファイルに残す
+  終了時に呼び出すこと
+  """
+  if record.strength_model != None:
+    record.strength_model.save()
+
+
+def main():
+  # data_moduleはこのモジュールを読み込むので、使うときに読み込む
+  import data_module
+
+  parser = argparse.ArgumentParser(description = "リターン率が100%を超える賭け方を高い順に表示する")
+  parser.add_argument("-r", "--record", default = "record.csv", help = "戦績ファイル")
+  parser.add_argument("-c", "--char", default = "char_name.csv", help = "キャラ一覧")
+  parser.add_argument("-n", "--count", type = int, default = 10, help = "表示する数")
+  parser.add_argument("--min-total", type = int, default = 1, help = "使う対戦カードの最低試合数")
+  args = parser.parse_args()
+
+  record = data_module.Record(args.record, data_module.NameList(args.char))
+  bet_list = best_bets(record, args.count, args.min_total)
+  if len(bet_list) == 0:
+    print("リターン率が100%を超える賭け方はありません")
+  for bet_rtp, row_index, slot in bet_list:
+    row = record.row(row_index)
+    print("{:.1f}%  {}  ({}  {}戦)".format(
+      bet_rtp * 100,
+      row.names[slot],
+      " / ".join(name for name in row.names if name != ""),
+      row.total))
+  record.close()
+
+
+if __name__ == "__main__":
+  main()
@@ -1,17 +1,42 @@
 import tkinter
+import tkinter.messagebox
 import gui_module
 import data_module
+import stats_module
+from collections import OrderedDict
+from typing import Callable
 
 
 DEL_IMAGE_FILE_NAME = "del_image.png"
 ENTER_IMAGE_FILE_NAME = "enter_image.png"
 
 
+def format_interval(interval: tuple[float, float]) -> str:
+  """
+  信用区間を画面表示用の文字列にする
+  """
+  return (format(stats_module.CREDIBLE_LEVEL * 100, ".0f") + "%区間 "
+          + format(interval[0] * 100, ".1f") + "~" + format(interval[1] * 100, ".1f") + "%")
+
+
+def commit_fight(record: data_module.Record, id_list: list[int], result: int, odds: list[float]):
+  """
+  record.commit_fight() を呼び、ファイルへの書き込みに失敗していたら知らせる
+  失敗していても1戦分はメモリ上に反映されているので、画面の遷移はそのまま続ける
+  """
+  try:
+    record.commit_fight(id_list, result, odds)
+  except Exception as error:
+    tkinter.messagebox.showerror("書き込みエラー",
+                                 "戦績をファイルに書き込めませんでした\n" + str(error))
+
+
 """
 ルーチンの構造
 MainRoutine
 ┣━_TitleRoutine
 ┣━_ReadModeRoutine
+┃ ┗━_CharacterSummaryRoutine
 ┣━_PlayModeRoutine
 ┃ ┣━_PlayModeCharacterSelectRoutine
 ┃ ┣━_PlayModeNoDataRoutine
@@ -22,7 +47,9 @@ MainRoutine
 並列の位置にあるルーチンはいずれか1つが実行される
 下層にあるルーチンは上層のルーチン内部で実行される
 
-MainRoutineは繰り返し実行される(これにより動的な処理ができる)
+MainRoutineはユーザの入力があるたびに実行される(これにより動的な処理ができる)
+set_action() やルーチンの生成をきっかけに、Tkが暇になったとき1回だけ実行される
+入力がない間は何も実行されない
 
 routine = routine.execute()
 というプログラムがあるが、これは繰り返し実行することにより任意のルーチンが
@@ -37,6 +64,9 @@ class Routine:
   あらゆるルーチンはこれを継承すること
   ルーチン内では必ずexecute()を定義し、ルーチンを実行する場合はこれを呼び出すこと
   """
+  # ルーチンの実行を要求する関数(main.pyで gui_module.Window.request_refresh を設定する)
+  refresh_requester: Callable = None
+
   def __init__(self, next_id = 1):
     """
     オーバーライド時はsuper()を使うなりしてこれを呼び出すこと
@@ -49,6 +79,9 @@ class Routine:
     # サブルーチンでは、引数で渡すことでメインルーチンとサブルーチンのどちらでも一意に定められる
     self.next_id = next_id
 
+    # 生成直後の画面更新のために1回実行する
+    self.request_refresh()
+
 
   def execute(self):
     """
@@ -72,6 +105,16 @@ class Routine:
     Bの書き方は、lambda式を記述した時点でのxの値を参照する。
     """
     self.action = arg
+    self.request_refresh()
+
+
+  def request_refresh(self):
+    """
+    ルーチンをもう1回実行させる
+    入力以外のきっかけで画面を更新したいとき(Entryの書き換えなど)に呼び出すこと
+    """
+    if Routine.refresh_requester != None:
+      Routine.refresh_requester()
 
 
 
@@ -83,7 +126,7 @@ class MainRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -93,7 +136,7 @@ class MainRoutine(Routine):
       ):
     super().__init__(next_id)
     self.next_routine = _TitleRoutine(root,
-                                      window_object_list,
+                                      window_object_registry,
                                       display_id_list,
                                       forget_id_list,
                                       destroy_id_list,
@@ -105,7 +148,7 @@ class MainRoutine(Routine):
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -113,7 +156,7 @@ class MainRoutine(Routine):
       record: data_module.Record,
       ):
     self.next_routine = self.next_routine.execute(root,
-                                                  window_object_list,
+                                                  window_object_registry,
                                                   display_id_list,
                                                   forget_id_list,
                                                   destroy_id_list,
@@ -130,7 +173,7 @@ class _TitleRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -141,7 +184,7 @@ class _TitleRoutine(Routine):
     
     super().__init__(next_id)
     
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id,
         place = (550, 250),
@@ -150,7 +193,7 @@ class _TitleRoutine(Routine):
                                       font = ('Yu Gothic UI', "15")),
         ),
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 1,
         place = (340, 400),
@@ -162,7 +205,7 @@ class _TitleRoutine(Routine):
                                        height = 1,),
         ),
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 2,
         place = (560, 400),
@@ -174,7 +217,7 @@ class _TitleRoutine(Routine):
                                        height = 1,),
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 3,
         place = (780, 400),
@@ -196,7 +239,7 @@ class _TitleRoutine(Routine):
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -213,7 +256,7 @@ class _TitleRoutine(Routine):
                           2: _PlayModeRoutine,
                           3: _DeleteModeRoutine,}
       next_routine = sub_routine_dict.get(self.action)(root,
-                                                       window_object_list,
+                                                       window_object_registry,
                                                        display_id_list,
                                                        forget_id_list,
                                                        destroy_id_list,
@@ -230,11 +273,16 @@ class _TitleRoutine(Routine):
 class _ReadModeRoutine(Routine):
   """
   ただファイルの戦績を表示するだけ
+  番号を指定して移動したり、キャラで絞り込んだり、並び替えたりできる
+  表示する文字列はページごとに作り、最近のものは使い回す
   """
+  # 作った表示用の文字列を何ページ分とっておくか
+  PAGE_CACHE_SIZE = 32
+
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -246,10 +294,13 @@ class _ReadModeRoutine(Routine):
     super().__init__(next_id)
 
     self.page = 1
-    self.id_list = [self.next_id+i for i in range(24)]
+    self.id_list = [self.next_id+i for i in range(32)]
     self.label_str = [tkinter.StringVar(root) for i in range(21)]
+    self.cursor = data_module.RecordCursor(record)
+    # {(記録のバージョン, 並び順, 絞り込むキャラ, ページ): 表示する文字列のリスト}
+    self.page_cache = OrderedDict()
 
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id,
         place = (50, 50),
@@ -261,7 +312,7 @@ class _ReadModeRoutine(Routine):
                                        height = 1,),
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 1,
         place = (500, 600),
@@ -273,7 +324,7 @@ class _ReadModeRoutine(Routine):
                                        height = 1,),
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 2,
         place = (800, 600),
@@ -307,7 +358,7 @@ class _ReadModeRoutine(Routine):
                   (600, 600),
                   (650, 600),
                   (700, 600), ]
-    window_object_list.extend([
+    window_object_registry.extend([
       gui_module.WindowObject(
         id = self.next_id + 3 + i,
         place = place_list[i],
@@ -317,17 +368,118 @@ class _ReadModeRoutine(Routine):
         ) for i in range(21)
       ])
     
+    window_object_registry.append(
+      gui_module.WindowObject(
+        id = self.next_id + 24,
+        place = (1100, 50),
+        window_object = tkinter.Button(root,
+                                       text = "キャラ別",
+                                       command = lambda : self.set_action(4),
+                                       font = ('Yu Gothic UI', "15"),
+                                       width = 8,
+                                       height = 1,),
+        )
+      )
+
+    self.jump_entry = tkinter.Entry(root,
+                                    font = ('Yu Gothic UI', "15"),
+                                    width = 6,
+                                    bg = "gray97",)
+    self.filter_entry = tkinter.Entry(root,
+                                      font = ('Yu Gothic UI', "15"),
+                                      width = 14,
+                                      bg = "gray97",)
+    window_object_registry.append(
+      gui_module.WindowObject(
+        id = self.next_id + 25,
+        place = (300, 700),
+        window_object = self.jump_entry,
+        )
+      )
+    window_object_registry.append(
+      gui_module.WindowObject(
+        id = self.next_id + 26,
+        place = (580, 700),
+        window_object = self.filter_entry,
+        )
+      )
+
+    button_list = [("番号へ移動", 5, (400, 695)),
+                   ("キャラで絞り込み", 6, (760, 695)),
+                   ("記録順", 7, (400, 780)),
+                   ("試合数順", 8, (560, 780)),
+                   ("リターン率順", 9, (720, 780)),]
+    for i in range(5):
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = self.next_id + 27 + i,
+          place = button_list[i][2],
+          window_object = tkinter.Button(root,
+                                         text = button_list[i][0],
+                                         command = lambda _action=button_list[i][1] : self.set_action(_action),
+                                         font = ('Yu Gothic UI', "12"),)
+          )
+        )
+
     display_id_list.extend(self.id_list)
 
-    self.next_id += 24
+    self.next_id += 32
 
     self.flush = True
+
+
+  def format_page(self, record: data_module.Record) -> list[str]:
+    """
+    self.pageページ目に表示する文字列のリストを作る
+    """
+    label_str_list = []
+    if self.page > len(self.cursor):
+      label_str_list.extend(["NO_DATA" for i in range(4)])
+      label_str_list.append("WIN")
+      label_str_list.extend(["NO_DATA" for i in range(4)])
+      label_str_list.append("RATIO")
+      label_str_list.extend(["NO_DATA" for i in range(4)])
+      label_str_list.append("TOTAL")
+      label_str_list.append("NO_DATA")
+      label_str_list.append("DRAW")
+      label_str_list.append("NO_DATA")
+      label_str_list.append("0")
+      label_str_list.append("/")
+      label_str_list.append("0")
+    else:
+      index = self.cursor.row_index(self.page - 1)
+      row = record.row(index)
+      matchup_stats = stats_module.matchup_stats(record, index)
+      label_str_list.extend(row.names)
+      label_str_list.append("WIN")
+      label_str_list.extend([str(win) for win in row.win_list])
+      label_str_list.append("RATIO")
+      label_str_list.extend([ str(format(
+        win_ratio * 100,
+        ".2f"
+        )) + '%'
+        for win_ratio in matchup_stats.win_ratio_list
+        ])
+      label_str_list.append("TOTAL")
+      label_str_list.append(str(row.total))
+      label_str_list.append("DRAW")
+      label_str_list.append(str(row.draw))
+      label_str_list.append(str(self.page))
+      label_str_list.append("/")
+      label_str_list.append(str(len(self.cursor)))
+      no_name_list = [i
+                      for i in range(4)
+                      if row.id_list[i] == data_module.NameList.EMPTY_ID]
+      for i in no_name_list:
+        label_str_list[5+i] = ""
+        label_str_list[10+i] = ""
+    return label_str_list
   
 
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -341,51 +493,45 @@ class _ReadModeRoutine(Routine):
         if self.page >= 2:
           self.page -= 1
       elif self.action == 3:
-        if self.page < len(record.data):
+        if self.page < len(self.cursor):
           self.page += 1      
       self.flush = True
       self.action = 0
 
+    elif self.action == 5:  # 番号を指定して移動
+      try:
+        page = int(self.jump_entry.get())
+      except ValueError:
+        page = self.page
+      self.page = min(max(page, 1), max(len(self.cursor), 1))
+      self.flush = True
+      self.action = 0
+
+    elif self.action in (6,7,8,9):  # 絞り込み・並び替え
+      if self.action == 6:
+        # 一覧にない名前や空欄の場合は絞り込まない
+        char_id = char_name_list.id_dict.get(self.filter_entry.get().strip())
+        order = self.cursor.order
+      else:
+        char_id = self.cursor.char_id
+        order = {7: data_module.RecordCursor.ORDER_RECORD,
+                 8: data_module.RecordCursor.ORDER_TOTAL,
+                 9: data_module.RecordCursor.ORDER_RTP,}.get(self.action)
+      self.cursor = data_module.RecordCursor(record, order, char_id)
+      self.page = 1
+      self.flush = True
+      self.action = 0
+
     if self.flush:  # 画面更新
-      label_str_list = []
-      if self.page > len(record.data):
-        label_str_list.extend(["NO_DATA" for i in range(4)])
-        label_str_list.append("WIN")
-        label_str_list.extend(["NO_DATA" for i in range(4)])
-        label_str_list.append("RATIO")
-        label_str_list.extend(["NO_DATA" for i in range(4)])
-        label_str_list.append("TOTAL")
-        label_str_list.append("NO_DATA")
-        label_str_list.append("DRAW")
-        label_str_list.append("NO_DATA")
-        label_str_list.append("0")
-        label_str_list.append("/")
-        label_str_list.append("0")
+      page_key = (record.version, self.cursor.order, self.cursor.char_id, self.page)
+      label_str_list = self.page_cache.get(page_key)
+      if label_str_list == None:
+        label_str_list = self.format_page(record)
+        self.page_cache[page_key] = label_str_list
+        if len(self.page_cache) > self.PAGE_CACHE_SIZE:
+          self.page_cache.popitem(last = False)
       else:
-        index = self.page - 1
-        label_str_list.extend(record.data[index][0:4])
-        label_str_list.append("WIN")
-        label_str_list.extend(record.data[index][5:9])
-        label_str_list.append("RATIO")
-        label_str_list.extend([ str(format(
-          int(record.data[index][5+i])/int(record.data[index][4]) * 100,
-          ".2f"
-          )) + '%'
-          for i in range(4)
-          ])
-        label_str_list.append("TOTAL")
-        label_str_list.append(record.data[index][4])
-        label_str_list.append("DRAW")
-        label_str_list.append(record.data[index][9])
-        label_str_list.append(str(index+1))
-        label_str_list.append("/")
-        label_str_list.append(str(len(record.data)))
-        no_name_list = [i
-                        for i in range(4)
-                        if record.data[index][i] == ""]
-        for i in no_name_list:
-          label_str_list[5+i] = ""
-          label_str_list[10+i] = ""
+        self.page_cache.move_to_end(page_key)
         
       for i in range(21):
         self.label_str[i].set(label_str_list[i])
@@ -393,10 +539,10 @@ class _ReadModeRoutine(Routine):
 
     if self.action == 1:
       destroy_id_list.extend(self.id_list)
-      del self.page, self.id_list, self.label_str
+      del self.page, self.id_list, self.label_str, self.cursor, self.page_cache
       self.action = 0
       next_routine = _TitleRoutine(root,
-                                   window_object_list,
+                                   window_object_registry,
                                    display_id_list,
                                    forget_id_list,
                                    destroy_id_list,
@@ -404,6 +550,162 @@ class _ReadModeRoutine(Routine):
                                    record,
                                    self.next_id)
 
+    elif self.action == 4:
+      destroy_id_list.extend(self.id_list)
+      del self.page, self.id_list, self.label_str, self.cursor, self.page_cache
+      self.action = 0
+      next_routine = _CharacterSummaryRoutine(root,
+                                              window_object_registry,
+                                              display_id_list,
+                                              forget_id_list,
+                                              destroy_id_list,
+                                              char_name_list,
+                                              record,
+                                              self.next_id)
+
+    return next_routine
+
+
+
+class _CharacterSummaryRoutine(Routine):
+  """
+  _ReadModeRoutine()から実行
+  キャラごとの戦績を試合数の多い順に表示する
+  集計はRecordが1戦ごとに更新しているので、ここでは並べて表示するだけ
+  """
+  # 1ページに表示するキャラの数
+  PAGE_SIZE = 20
+
+  def __init__(
+      self,
+      root: tkinter.Tk, 
+      window_object_registry: gui_module.WindowObjectRegistry,
+      display_id_list: list[int],
+      forget_id_list: list[int],
+      destroy_id_list: list[int],
+      char_name_list: data_module.NameList,
+      record: data_module.Record,
+      next_id: int = 1,
+      ):
+    
+    super().__init__(next_id)
+
+    self.page = 0
+    self.id_list = [self.next_id+i for i in range(16)]
+    # 列ごとに1つのラベルに改行区切りで表示する
+    self.column_str = [tkinter.StringVar(root) for i in range(6)]
+    self.page_str = tkinter.StringVar(root)
+
+    button_list = [("◁", 1, (50, 50)),
+                   ("◁", 2, (500, 800)),
+                   ("▷", 3, (800, 800)),]
+    for i in range(3):
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = self.next_id + i,
+          place = button_list[i][2],
+          window_object = tkinter.Button(root,
+                                         text = button_list[i][0],
+                                         command = lambda _action=button_list[i][1] : self.set_action(_action),
+                                         font = ('Yu Gothic UI', "15"),
+                                         width = 4,
+                                         height = 1,),
+          )
+        )
+
+    header_list = ["キャラ", "試合数", "勝率", "引き分け率", "平均オッズ", "リターン率"]
+    x_list = [150, 400, 550, 700, 850, 1000]
+    for i in range(6):
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = self.next_id + 3 + i,
+          place = (x_list[i], 100),
+          window_object = tkinter.Label(root,
+                                        text = header_list[i],
+                                        font = ('Yu Gothic UI', "13", "bold"),)
+          )
+        )
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = self.next_id + 9 + i,
+          place = (x_list[i], 140),
+          window_object = tkinter.Label(root,
+                                        textvariable = self.column_str[i],
+                                        justify = "left",
+                                        font = ('Yu Gothic UI', "13"),)
+          )
+        )
+    window_object_registry.append(
+      gui_module.WindowObject(
+        id = self.next_id + 15,
+        place = (630, 805),
+        window_object = tkinter.Label(root,
+                                      textvariable = self.page_str,
+                                      font = ('Yu Gothic UI', "15"),)
+        )
+      )
+
+    display_id_list.extend(self.id_list)
+
+    self.next_id += 16
+
+    self.flush = True
+
+
+  def execute(
+      self,
+      root: tkinter.Tk, 
+      window_object_registry: gui_module.WindowObjectRegistry,
+      display_id_list: list[int],
+      forget_id_list: list[int],
+      destroy_id_list: list[int],
+      char_name_list: data_module.NameList,
+      record: data_module.Record,
+      ):
+    next_routine = self
+
+    character_stats_dict = record.character_stats_dict
+    char_id_list = sorted(character_stats_dict,
+                          key = lambda char_id: character_stats_dict[char_id].appearances,
+                          reverse = True)
+    page_count = max((len(char_id_list) + self.PAGE_SIZE - 1) // self.PAGE_SIZE, 1)
+
+    if self.action in (2,3):  # ページ切り替え
+      if self.action == 2 and self.page >= 1:
+        self.page -= 1
+      elif self.action == 3 and self.page < page_count - 1:
+        self.page += 1
+      self.flush = True
+      self.action = 0
+
+    if self.flush:  # 画面更新
+      column_list = [[] for i in range(6)]
+      for char_id in char_id_list[self.page*self.PAGE_SIZE : (self.page+1)*self.PAGE_SIZE]:
+        character_stats = character_stats_dict[char_id]
+        column_list[0].append(char_name_list.to_name(char_id))
+        column_list[1].append(str(character_stats.appearances))
+        column_list[2].append(str(format(character_stats.win_ratio * 100, ".2f")) + "%")
+        column_list[3].append(str(format(character_stats.draw_ratio * 100, ".2f")) + "%")
+        column_list[4].append(str(format(character_stats.mean_odds, ".2f")))
+        column_list[5].append(str(format(character_stats.rtp * 100, ".2f")) + "%")
+      for i in range(6):
+        self.column_str[i].set("\n".join(column_list[i]))
+      self.page_str.set(str(self.page+1) + " / " + str(page_count))
+      self.flush = False
+
+    if self.action == 1:
+      destroy_id_list.extend(self.id_list)
+      del self.page, self.id_list, self.column_str, self.page_str
+      self.action = 0
+      next_routine = _ReadModeRoutine(root,
+                                      window_object_registry,
+                                      display_id_list,
+                                      forget_id_list,
+                                      destroy_id_list,
+                                      char_name_list,
+                                      record,
+                                      self.next_id)
+
     return next_routine
 
 
@@ -416,7 +718,7 @@ class _PlayModeRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -427,9 +729,9 @@ class _PlayModeRoutine(Routine):
     
     super().__init__(next_id)
 
-    self.sub_routine = _PlayModeCharacterSelectRoutine(
+    self.sub_routine = _PlayModeCharacterSelectRoutine.open(
       root,
-      window_object_list,
+      window_object_registry,
       display_id_list,
       forget_id_list,
       destroy_id_list,
@@ -442,7 +744,7 @@ class _PlayModeRoutine(Routine):
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -453,7 +755,7 @@ class _PlayModeRoutine(Routine):
 
     self.sub_routine = self.sub_routine.execute(
       root,
-      window_object_list,
+      window_object_registry,
       display_id_list,
       forget_id_list,
       destroy_id_list,
@@ -472,7 +774,7 @@ class _DeleteModeRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -488,7 +790,7 @@ class _DeleteModeRoutine(Routine):
       self.next_id + 3,
       ))
     
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id,
         place = (50, 50),
@@ -500,7 +802,7 @@ class _DeleteModeRoutine(Routine):
                                        height = 1,)
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 1,
         place = (580, 500),
@@ -511,7 +813,7 @@ class _DeleteModeRoutine(Routine):
                                        font = ("Yu Gothic UI", "20", "bold"),)
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 2,
         place = (300, 300),
@@ -529,7 +831,7 @@ class _DeleteModeRoutine(Routine):
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -539,10 +841,9 @@ class _DeleteModeRoutine(Routine):
     next_routine = self
 
     if self.action == 2:
-      record.data = []
-      record.write()
+      record.clear()
       next_routine = _TitleRoutine(root,
-                                   window_object_list,
+                                   window_object_registry,
                                    display_id_list,
                                    forget_id_list,
                                    destroy_id_list,
@@ -555,7 +856,7 @@ class _DeleteModeRoutine(Routine):
 
     elif self.action == 1:
       next_routine = _TitleRoutine(root,
-                                   window_object_list,
+                                   window_object_registry,
                                    display_id_list,
                                    forget_id_list,
                                    destroy_id_list,
@@ -575,11 +876,49 @@ class _PlayModeCharacterSelectRoutine(Routine):
   _PlayModeRoutine()の内部で実行
   キャラを最大4体選択する
   記録の有無に応じて異なるルーチンを実行
+
+  キャラの数だけボタンがあり作り直すと重いので、画面を離れるときは破棄せずに隠し、
+  次からは open() で選択状態をリセットして再表示する
   """
+  # 作成済みの画面
+  _cached_routine = None
+
+  @classmethod
+  def open(
+      cls,
+      root: tkinter.Tk, 
+      window_object_registry: gui_module.WindowObjectRegistry,
+      display_id_list: list[int],
+      forget_id_list: list[int],
+      destroy_id_list: list[int],
+      char_name_list: data_module.NameList,
+      record: data_module.Record,
+      next_id: int = 1,
+      ):
+    """
+    キャラ選択画面を開く
+    作成済みの画面があればそれを使い回す
+    """
+    routine = cls._cached_routine
+    if routine == None or routine.root is not root:
+      routine = cls(root,
+                    window_object_registry,
+                    display_id_list,
+                    forget_id_list,
+                    destroy_id_list,
+                    char_name_list,
+                    record,
+                    next_id)
+      cls._cached_routine = routine
+    else:
+      routine.reset(window_object_registry, display_id_list, next_id)
+    return routine
+
+
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -592,15 +931,18 @@ class _PlayModeCharacterSelectRoutine(Routine):
 
     char_name_list_len = len(char_name_list.data)
 
+    self.root = root
     self.id_list = list(range(
       self.next_id,
       self.next_id + 8 + char_name_list_len
       ))
+    # 背景色を変えたキャラボタン {キャラid: 色}
+    self.button_color_dict = {}
     
-    self.del_img = data_module.Image(DEL_IMAGE_FILE_NAME).data
-    self.enter_img = data_module.Image(ENTER_IMAGE_FILE_NAME).data
+    self.del_img = data_module.image_cache.get(DEL_IMAGE_FILE_NAME)
+    self.enter_img = data_module.image_cache.get(ENTER_IMAGE_FILE_NAME)
     
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id,
         place = (50, 50),
@@ -612,7 +954,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
                                        height = 1,)
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 1,
         place = (900, 50),
@@ -621,7 +963,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
                                        command = lambda : self.set_action(2))
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 2,
         place = (1100, 50),
@@ -631,10 +973,11 @@ class _PlayModeCharacterSelectRoutine(Routine):
         )
       )
     
+    self.char_button_first_id = self.next_id + 3
     for i in range(char_name_list_len):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
-          id = self.next_id + 3 + i,
+          id = self.char_button_first_id + i,
           place = (50 + 122*(i%10), 200 + 47*(i//10)),
           window_object = tkinter.Button(root,
                                          text = char_name_list.data[i][0],
@@ -645,7 +988,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
           )
         )
       
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 3 + char_name_list_len,
         place = (400, 80),
@@ -658,7 +1001,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
     self.selected_char_name_list = [tkinter.StringVar(root, "") for i in range(4)]
 
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = self.next_id + 4 + char_name_list_len + i,
           place = (150 + 170*i, 120),
@@ -671,12 +1014,51 @@ class _PlayModeCharacterSelectRoutine(Routine):
     display_id_list.extend(self.id_list)
 
     self.next_id += 8 + char_name_list_len
+
+
+  def reset(
+      self,
+      window_object_registry: gui_module.WindowObjectRegistry,
+      display_id_list: list[int],
+      next_id: int,
+      ):
+    """
+    選択状態を初期化して再表示する
+    """
+    self.action = 0
+    self.next_id = next_id
+    for i in range(4):
+      self.selected_char_name_list[i].set("")
+    self.set_button_color(window_object_registry, {})
+    display_id_list.extend(self.id_list)
+
+
+  def set_button_color(
+      self,
+      window_object_registry: gui_module.WindowObjectRegistry,
+      button_color_dict: dict[int, str],
+      ):
+    """
+    キャラボタンの背景色を設定する {キャラid: 色}
+    含まれないキャラは白になる
+    変化したボタンだけ設定し直す
+    """
+    for char_id in self.button_color_dict.keys() - button_color_dict.keys():
+      window_object_registry.get(self.char_button_first_id+char_id).window_object.configure(
+        bg = "white"
+      )
+    for char_id, color in button_color_dict.items():
+      if self.button_color_dict.get(char_id) != color:
+        window_object_registry.get(self.char_button_first_id+char_id).window_object.configure(
+          bg = color
+        )
+    self.button_color_dict = button_color_dict
     
 
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -693,40 +1075,17 @@ class _PlayModeCharacterSelectRoutine(Routine):
         name = self.selected_char_name_list[i].get()
         if name != "":
           selecting_char_name_list.append(name)
+      button_color_dict = {}
       if len(selecting_char_name_list) != 0:
-        selecting_list = [char_name_list.data.index([name])
+        selecting_list = [char_name_list.to_id(name)
                           for name in selecting_char_name_list]
-        suggestion_name_set = set()
-        for i in range(len(record.data)):
-          all_in = True
-          for each_selecting_char_name in selecting_char_name_list:
-            if each_selecting_char_name not in record.data[i][0:4]:
-              all_in = False
-              break
-          if all_in:
-            for each_name in record.data[i][0:4]:
-              if each_name != "" and each_name not in selecting_char_name_list:
-                suggestion_name_set.add(each_name)
-        suggestion_set = set()
-        for each_name in suggestion_name_set:
-          suggestion_set.add(char_name_list.data.index([each_name]))
-        for i in range(char_name_list_len):
-          window_object_list[self.next_id-6-char_name_list_len+i].window_object.configure(
-            bg = "white"
-          )
-        for i in selecting_list:
-          window_object_list[self.next_id-6-char_name_list_len+i].window_object.configure(
-            bg = "green"
-          )
-        for i in suggestion_set:
-          window_object_list[self.next_id-6-char_name_list_len+i].window_object.configure(
-            bg = "yellow"
-          )
-      else:
-        for i in range(char_name_list_len):
-          window_object_list[self.next_id-6-char_name_list_len+i].window_object.configure(
-            bg = "white"
-          )
+        # char_name.csvから消えたキャラはボタンがないので無視する
+        for char_id in record.suggestions(selecting_list):
+          if char_name_list.is_listed(char_id):
+            button_color_dict[char_id] = "yellow"
+        for char_id in selecting_list:
+          button_color_dict[char_id] = "green"
+      self.set_button_color(window_object_registry, button_color_dict)
 
     if self.action in list(range(4, 4+char_name_list_len)):
       new_index = 0
@@ -736,7 +1095,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
         else:
           break
       if new_index < 4:
-        self.selected_char_name_list[new_index].set(char_name_list.data[self.action-4][0])
+        self.selected_char_name_list[new_index].set(char_name_list.to_name(self.action-4))
       change_suggestion_color()
       self.action = 0
 
@@ -753,15 +1112,12 @@ class _PlayModeCharacterSelectRoutine(Routine):
       self.action = 0
 
     elif self.action == 3:
-      destroy_id_list.extend(self.id_list)
+      forget_id_list.extend(self.id_list)
       str_list = [self.selected_char_name_list[i].get() for i in range(4)]
-      record_index = None
-      for i in range(len(record.data)):
-        if set(str_list) == set(record.data[i][0:4]):
-          record_index = i
+      record_index = record.find([char_name_list.to_id(name) for name in str_list])
       if record_index != None:
         next_routine = _PlayModeCalculateRoutine(root,
-                                                 window_object_list,
+                                                 window_object_registry,
                                                  display_id_list,
                                                  forget_id_list,
                                                  destroy_id_list,
@@ -773,7 +1129,7 @@ class _PlayModeCharacterSelectRoutine(Routine):
       else:
         next_routine = _PlayModeNoDataRoutine(
           root,
-          window_object_list,
+          window_object_registry,
           display_id_list,
           forget_id_list,
           destroy_id_list,
@@ -783,15 +1139,13 @@ class _PlayModeCharacterSelectRoutine(Routine):
           self.next_id,
           )
 
-      del self.id_list, self.selected_char_name_list
       self.action = 0
 
     elif self.action == 1:
-      destroy_id_list.extend(self.id_list)
-      del self.id_list, self.selected_char_name_list
+      forget_id_list.extend(self.id_list)
       self.action = 0
       next_routine = _TitleRoutine(root,
-                                   window_object_list,
+                                   window_object_registry,
                                    display_id_list,
                                    forget_id_list,
                                    destroy_id_list,
@@ -812,7 +1166,7 @@ class _PlayModeNoDataRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -824,10 +1178,10 @@ class _PlayModeNoDataRoutine(Routine):
     
     super().__init__(next_id)
 
-    self.id_list = list(range(self.next_id, self.next_id+7))
+    self.id_list = list(range(self.next_id, self.next_id+12))
     self.selected_char_name_list = selected_char_name_list
 
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id,
         place = (550, 500),
@@ -839,7 +1193,7 @@ class _PlayModeNoDataRoutine(Routine):
                                        height = 2,)
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 1,
         place = (550, 600),
@@ -851,7 +1205,7 @@ class _PlayModeNoDataRoutine(Routine):
                                        height = 2,)
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = self.next_id + 2,
         place = (450, 100),
@@ -862,7 +1216,7 @@ class _PlayModeNoDataRoutine(Routine):
       )
     
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = self.next_id + 3 + i,
           place = (250 + 200*i, 200),
@@ -873,16 +1227,45 @@ class _PlayModeNoDataRoutine(Routine):
                                         height = 2,),
           )
         )
+
+    # 他の対戦カードの記録から推定したキャラの強さで勝率を予想する
+    probability_list = stats_module.strength_model(record).predict(
+      [char_name_list.to_id(name) for name in self.selected_char_name_list]
+      )
+    for i in range(4):
+      if self.selected_char_name_list[i] == "":
+        text = ""
+      else:
+        text = "予想勝率 " + str(format(probability_list[i] * 100, ".2f")) + "%"
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = self.next_id + 7 + i,
+          place = (250 + 200*i, 280),
+          window_object = tkinter.Label(root,
+                                        text = text,
+                                        font = ("Yu Gothic UI", "13"),
+                                        width = 18,),
+          )
+        )
+    window_object_registry.append(
+      gui_module.WindowObject(
+        id = self.next_id + 11,
+        place = (550, 350),
+        window_object = tkinter.Label(root,
+                                      text = "予想引き分け率 " + str(format(probability_list[4] * 100, ".2f")) + "%",
+                                      font = ("Yu Gothic UI", "13"),),
+        )
+      )
         
     display_id_list.extend(self.id_list)
 
-    self.next_id += 7
+    self.next_id += 12
 
 
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -895,7 +1278,7 @@ class _PlayModeNoDataRoutine(Routine):
       destroy_id_list.extend(self.id_list)
       self.action = 0
       next_routine = _PlayModeMakeNewDataRoutine(root,
-                                                 window_object_list,
+                                                 window_object_registry,
                                                  display_id_list,
                                                  forget_id_list,
                                                  destroy_id_list,
@@ -908,14 +1291,14 @@ class _PlayModeNoDataRoutine(Routine):
     elif self.action == 2:
       destroy_id_list.extend(self.id_list)
       self.action = 0
-      next_routine = _PlayModeCharacterSelectRoutine(root,
-                                                     window_object_list,
-                                                     display_id_list,
-                                                     forget_id_list,
-                                                     destroy_id_list,
-                                                     char_name_list,
-                                                     record,
-                                                     self.next_id)
+      next_routine = _PlayModeCharacterSelectRoutine.open(root,
+                                                          window_object_registry,
+                                                          display_id_list,
+                                                          forget_id_list,
+                                                          destroy_id_list,
+                                                          char_name_list,
+                                                          record,
+                                                          self.next_id)
       del self.id_list, self.selected_char_name_list
 
     return next_routine
@@ -932,7 +1315,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -950,7 +1333,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
                          for i in range(4)
                          if self.selected_char_name_list[i] == ""]
 
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id,
         place = (50, 50),
@@ -964,7 +1347,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
       )
     
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 1 + i,
         place = (300 + 200*i, 690),
@@ -978,7 +1361,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
       )
     forget_id_list.extend([next_id+1+i for i in self.no_char_list])
 
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 5,
         place = (1100, 690),
@@ -996,7 +1379,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
                                      width = 10,
                                      bg = "gray97",) for i in range(4)]
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 6 + i,
           place = (300 + 200*i, 410),
@@ -1005,7 +1388,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
         )
     forget_id_list.extend([next_id+6+i for i in self.no_char_list])
       
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 10,
         place = (100, 400),
@@ -1016,7 +1399,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
                                       height = 2,),
         )
       )
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 11,
         place = (100, 700),
@@ -1029,7 +1412,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
       )
     
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 12 + i,
           place = (300 + 200*i, 100),
@@ -1050,7 +1433,7 @@ class _PlayModeMakeNewDataRoutine(Routine):
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -1061,43 +1444,29 @@ class _PlayModeMakeNewDataRoutine(Routine):
 
     if self.action in range(1, 7):
       if self.action == 1:
-        next_routine = _PlayModeCharacterSelectRoutine(root,
-                                                       window_object_list,
-                                                       display_id_list,
-                                                       forget_id_list,
-                                                       destroy_id_list,
-                                                       char_name_list,
-                                                       record,
-                                                       self.next_id,)
+        next_routine = _PlayModeCharacterSelectRoutine.open(root,
+                                                            window_object_registry,
+                                                            display_id_list,
+                                                            forget_id_list,
+                                                            destroy_id_list,
+                                                            char_name_list,
+                                                            record,
+                                                            self.next_id,)
 
       elif self.action in range(2, 7):
-        # キャラクター名を番号と対応付ける
-        # 選択されていないキャラは最後のキャラ+1にする（複数いた場合はさらに+2,+3して区別）
-        char_name_index_list = []
-        over_index_to_sort_none_data = 0
-        for i in range(4):
-          if i not in self.no_char_list:
-            for index in range(len(char_name_list.data)):
-              if char_name_list.data[index][0] == self.selected_char_name_list[i]:
-                break
-          else:
-            index = len(char_name_list.data) + over_index_to_sort_none_data
-            over_index_to_sort_none_data += 1
-          char_name_index_list.append(index)
-
-        sorted_char_name_index_list = sorted(char_name_index_list)
-        
+        # キャラクター名をidに置き換えてchar_name.csvの順に並べる
+        # 選択されていないキャラは最後になる（同じidが複数いた場合は選択順のまま）
+        char_id_list = [char_name_list.to_id(name) for name in self.selected_char_name_list]
+        slot_list = stats_module.sort_slot_list(char_id_list)
+
         index_dict = {}
         for i in range(4):
-          index = sorted_char_name_index_list.index(char_name_index_list[i])
-          index_dict[i] = index
-          # 同じ名前or選択されていないキャラが複数いた場合区別するために既に使った名前をありえない値にセット
-          sorted_char_name_index_list[index] = -1
+          index_dict[i] = slot_list[i]
         index_dict[4] = 4
 
-        sorted_selected_char_name_list = [""] * 4
+        sorted_char_id_list = [0] * 4
         for i in range(4):
-          sorted_selected_char_name_list[index_dict.get(i)] = self.selected_char_name_list[i]
+          sorted_char_id_list[index_dict.get(i)] = char_id_list[i]
 
         def tofloat(num: str):
           try:
@@ -1111,27 +1480,19 @@ class _PlayModeMakeNewDataRoutine(Routine):
         for i in range(4):
           sorted_odds_list[index_dict.get(i)] = odds_list[i]
 
-        new_record = []
-        new_record.extend(sorted_selected_char_name_list)
-        new_record.append("1")
-        for i in range(index_dict.get(self.action-2)):
-          new_record.append("0")
-        new_record.append("1")
-        for i in range(4-index_dict.get(self.action-2)):
-          new_record.append("0")
-        new_record.extend(sorted_odds_list)
-
-        record.data.append(new_record)
-        record.write()
-
-        next_routine = _PlayModeCharacterSelectRoutine(root,
-                                                      window_object_list,
-                                                      display_id_list,
-                                                      forget_id_list,
-                                                      destroy_id_list,
-                                                      char_name_list,
-                                                      record,
-                                                      self.next_id)
+        commit_fight(record,
+                     sorted_char_id_list,
+                     index_dict.get(self.action-2),
+                     sorted_odds_list)
+
+        next_routine = _PlayModeCharacterSelectRoutine.open(root,
+                                                            window_object_registry,
+                                                            display_id_list,
+                                                            forget_id_list,
+                                                            destroy_id_list,
+                                                            char_name_list,
+                                                            record,
+                                                            self.next_id)
 
 
       destroy_id_list.extend(self.id_list)
@@ -1146,13 +1507,14 @@ class _PlayModeMakeNewDataRoutine(Routine):
 class _PlayModeCalculateRoutine(Routine):
   """
   キャラの名前、勝率、オッズが入力された場合にリターン率を表示
+  あわせて、ケリー基準で資金の何割を賭けるとよいかを表示
   勝ったキャラもしくは引き分けを選択
   戦績作成後はキャラ選択画面に戻る
   """
   def __init__(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -1165,19 +1527,21 @@ class _PlayModeCalculateRoutine(Routine):
     
     super().__init__(next_id)
 
-    self.id_list = list(range(next_id, next_id+26))
+    self.id_list = list(range(next_id, next_id+38))
     self.selected_char_name_list = selected_char_name_list
     self.record_index = record_index
     self.no_char_list = [i
                          for i in range(4)
                          if self.selected_char_name_list[i] == ""]
 
+    slot_list = record.slot_list(self.record_index,
+                                 [char_name_list.to_id(name) for name in self.selected_char_name_list])
     self.char_index_dict = {}
     for i in range(4):
-      self.char_index_dict[i] = record.data[self.record_index].index(self.selected_char_name_list[i])
+      self.char_index_dict[i] = slot_list[i]
     self.char_index_dict[4] = 4
 
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id,
         place = (50, 50),
@@ -1191,7 +1555,7 @@ class _PlayModeCalculateRoutine(Routine):
       )
     
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 1 + i,
         place = (300 + 200*i, 690),
@@ -1204,7 +1568,7 @@ class _PlayModeCalculateRoutine(Routine):
         )
       )
     forget_id_list.extend([next_id+1+i for i in self.no_char_list])
-    window_object_list.append(
+    window_object_registry.append(
       gui_module.WindowObject(
         id = next_id + 5,
         place = (1100, 690),
@@ -1217,10 +1581,18 @@ class _PlayModeCalculateRoutine(Routine):
         )
       )
     
+    self.odds_str_list = [
+      tkinter.StringVar(root, record.odds_column_list[self.char_index_dict.get(i)][record_index])
+      for i in range(4)
+      ]
+    # オッズが書き換えられたときだけリターン率を計算し直す
+    self.odds_changed = True
+    for i in range(4):
+      self.odds_str_list[i].trace_add("write", lambda *args : self.on_odds_change())
     self.entry_list = [
       tkinter.Entry(
         root,
-        textvariable = tkinter.StringVar(root, record.data[record_index][10+self.char_index_dict.get(i)]),
+        textvariable = self.odds_str_list[i],
         font = ("Yu Gothic UI", "20"),
         width = 10,
         bg = "gray97",
@@ -1228,7 +1600,7 @@ class _PlayModeCalculateRoutine(Routine):
       for i in range(4)
       ]
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 6 + i,
           place = (300 + 200*i, 410),
@@ -1238,8 +1610,10 @@ class _PlayModeCalculateRoutine(Routine):
     forget_id_list.extend([next_id+6+i for i in self.no_char_list])
       
     self.textvariable_list_rtp = [tkinter.StringVar(root, "") for i in range(4)]
+    # 最後にリターン率を計算したときの (記録のバージョン, オッズ)
+    self.rtp_key = None
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 10 + i,
           place = (300 + 200*i, 550),
@@ -1254,7 +1628,7 @@ class _PlayModeCalculateRoutine(Routine):
     
     text_list = ["勝率","オッズ","リターン率","結果"]
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 14 + i,
           place = (100, 250 + 150*i),
@@ -1267,7 +1641,7 @@ class _PlayModeCalculateRoutine(Routine):
         )
       
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 18 + i,
           place = (300 + 200*i, 100),
@@ -1279,16 +1653,17 @@ class _PlayModeCalculateRoutine(Routine):
           )
         )
     forget_id_list.extend([next_id+18+i for i in self.no_char_list])
-      
+
+    matchup_stats = stats_module.matchup_stats(record, record_index)
     for i in range(4):
-      window_object_list.append(
+      window_object_registry.append(
         gui_module.WindowObject(
           id = next_id + 22 + i,
           place = (300 + 200*i, 250),
           window_object = tkinter.Label(
             root,
             text = str( format(
-              int(record.data[record_index][5+self.char_index_dict.get(i)])/int(record.data[record_index][4]) * 100,
+              matchup_stats.win_ratio_list[self.char_index_dict.get(i)] * 100,
                                '.2f') ) + "%",
             font = ("Yu Gothic UI", "15"),
             width = 15,
@@ -1298,15 +1673,69 @@ class _PlayModeCalculateRoutine(Routine):
         )
     forget_id_list.extend([next_id+22+i for i in self.no_char_list])
 
+    # 試合数が少ないと当てにならないので、ベイズ推定による信用区間も表示する
+    self.posterior_stats = stats_module.posterior_stats(record, record_index)
+    for i in range(4):
+      interval = self.posterior_stats.interval_list[self.char_index_dict.get(i)]
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = next_id + 26 + i,
+          place = (300 + 200*i, 300),
+          window_object = tkinter.Label(
+            root,
+            text = format_interval(interval),
+            font = ("Yu Gothic UI", "10"),
+            width = 22,
+            )
+          )
+        )
+    forget_id_list.extend([next_id+26+i for i in self.no_char_list])
+
+    self.textvariable_list_rtp_interval = [tkinter.StringVar(root, "") for i in range(4)]
+    for i in range(4):
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = next_id + 30 + i,
+          place = (300 + 200*i, 600),
+          window_object = tkinter.Label(root,
+                                        textvariable = self.textvariable_list_rtp_interval[i],
+                                        font = ("Yu Gothic UI", "10"),
+                                        width = 22,)
+          )
+        )
+    forget_id_list.extend([next_id+30+i for i in self.no_char_list])
+
+    # 勝率と引き分け率は信用区間と同じ事後平均を使う
+    self.textvariable_list_kelly = [tkinter.StringVar(root, "") for i in range(4)]
+    # {(記録のバージョン, オッズ): 表示する文字列のリスト}
+    self.kelly_cache = {}
+    for i in range(4):
+      window_object_registry.append(
+        gui_module.WindowObject(
+          id = next_id + 34 + i,
+          place = (300 + 200*i, 640),
+          window_object = tkinter.Label(root,
+                                        textvariable = self.textvariable_list_kelly[i],
+                                        font = ("Yu Gothic UI", "10"),
+                                        width = 22,)
+          )
+        )
+    forget_id_list.extend([next_id+34+i for i in self.no_char_list])
+
     display_id_list.extend(self.id_list)
 
-    self.next_id += 26
+    self.next_id += 38
+
+
+  def on_odds_change(self):
+    self.odds_changed = True
+    self.request_refresh()
 
   
   def execute(
       self,
       root: tkinter.Tk, 
-      window_object_list: list[gui_module.WindowObject],
+      window_object_registry: gui_module.WindowObjectRegistry,
       display_id_list: list[int],
       forget_id_list: list[int],
       destroy_id_list: list[int],
@@ -1323,30 +1752,58 @@ class _PlayModeCalculateRoutine(Routine):
         ret = None
       return ret
       
-    odds_list = [tofloat(self.entry_list[i].get()) for i in range(4)]
-    
     def tortp(odds, player: int):
-      # rtp = (win_ratio * odds) + (draw_ratio * 1)
-      #     = win_ratio * odds + draw_ratio
       if (odds == None) or (player not in range(4)):
         return ""
       else:
-        total_fight = int(record.data[self.record_index][4])
-        win_ratio = int(record.data[self.record_index][5+self.char_index_dict.get(player)]) / total_fight
-        draw_ratio = int(record.data[self.record_index][9]) / total_fight
-        return str(format((win_ratio * odds + draw_ratio) * 100, ".2f")) + "%"
+        rtp = matchup_stats.rtp_at(self.char_index_dict.get(player), odds)
+        return str(format(rtp * 100, ".2f")) + "%"
 
-    for i in range(4):
-      self.textvariable_list_rtp[i].set(tortp(odds_list[i], i))
+    def tortp_interval(odds, player: int):
+      if (odds == None) or (player not in range(4)):
+        return ""
+      else:
+        return format_interval(self.posterior_stats.rtp_interval(self.char_index_dict.get(player), odds))
+
+    def tokelly(odds, player: int):
+      if (odds == None) or (player not in range(4)):
+        return ""
+      kelly = stats_module.kelly_fraction(self.posterior_stats.mean_list[self.char_index_dict.get(player)],
+                                          self.posterior_stats.draw_mean,
+                                          odds)
+      if kelly <= 0.0:
+        return "賭けない方がよい"
+      return "賭け金: 資金の" + str(format(kelly * 100, ".1f")) + "%"
+
+    if self.odds_changed:
+      self.odds_changed = False
+      odds_list = [tofloat(self.odds_str_list[i].get()) for i in range(4)]
+      rtp_key = (record.version, tuple(odds_list))
+      if rtp_key != self.rtp_key:
+        self.rtp_key = rtp_key
+        matchup_stats = stats_module.matchup_stats(record, self.record_index)
+        for i in range(4):
+          rtp_str = tortp(odds_list[i], i)
+          if self.textvariable_list_rtp[i].get() != rtp_str:
+            self.textvariable_list_rtp[i].set(rtp_str)
+          rtp_interval_str = tortp_interval(odds_list[i], i)
+          if self.textvariable_list_rtp_interval[i].get() != rtp_interval_str:
+            self.textvariable_list_rtp_interval[i].set(rtp_interval_str)
+
+        kelly_str_list = self.kelly_cache.get(rtp_key)
+        if kelly_str_list == None:
+          kelly_str_list = [tokelly(odds_list[i], i) for i in range(4)]
+          # 入力のたびに増えるので、増えすぎたら捨てる
+          if len(self.kelly_cache) >= 64:
+            self.kelly_cache.clear()
+          self.kelly_cache[rtp_key] = kelly_str_list
+        for i in range(4):
+          if self.textvariable_list_kelly[i].get() != kelly_str_list[i]:
+            self.textvariable_list_kelly[i].set(kelly_str_list[i])
 
 
     if self.action in range(1, 7):
       if self.action in range(2, 7):
-        record.data[self.record_index][4] = str(int(record.data[self.record_index][4])+1)
-        record.data[self.record_index][5+self.char_index_dict.get(self.action-2)] = str(int(
-          record.data[self.record_index][5+self.char_index_dict.get(self.action-2)]
-          )+1)
-        
         def get_odds_num(index: int):
           try:
             ret = float(self.entry_list[index].get())
@@ -1354,21 +1811,26 @@ class _PlayModeCalculateRoutine(Routine):
             ret = 0
           return ret
 
+        sorted_odds_list = record.row(self.record_index).odds_list
         for i in range(4):
-          record.data[self.record_index][10+self.char_index_dict.get(i)] = get_odds_num(i)
-        record.write()
+          sorted_odds_list[self.char_index_dict.get(i)] = get_odds_num(i)
+        commit_fight(record,
+                     record.row_id_list(self.record_index),
+                     self.char_index_dict.get(self.action-2),
+                     sorted_odds_list)
       
       destroy_id_list.extend(self.id_list)
-      del self.id_list, self.record_index, self.textvariable_list_rtp, self.char_index_dict, self.entry_list
+      del self.id_list, self.record_index, self.textvariable_list_rtp, self.char_index_dict, self.entry_list, self.odds_str_list, self.rtp_key
+      del self.posterior_stats, self.textvariable_list_rtp_interval, self.textvariable_list_kelly, self.kelly_cache
       self.action = 0
 
-      next_routine = _PlayModeCharacterSelectRoutine(root,
-                                                     window_object_list,
-                                                     display_id_list,
-                                                     forget_id_list,
-                                                     destroy_id_list,
-                                                     char_name_list,
-                                                     record,
-                                                     self.next_id)
+      next_routine = _PlayModeCharacterSelectRoutine.open(root,
+                                                          window_object_registry,
+                                                          display_id_list,
+                                                          forget_id_list,
+                                                          destroy_id_list,
+                                                          char_name_list,
+                                                          record,
+                                                          self.next_id)
 
     return next_routine
\ No newline at end of file